@@ -49,6 +49,30 @@ class FlyArgs(object):
         gui_help = "Use this flag if you want to use the GUI to view the "\
                    "drone's camera. Default is to not launch the GUI."
         verbosity_help = 'Increase the output verbosity.'
+        decode_help = "When to decode the frames of the camera stream. Use "\
+                      "'always' to decode every frame or 'demand' to only "\
+                      "decode frames while the flying tool is waiting for one."
+        video_help = "Replay the frames of a video file or a trajectory "\
+                     "directory of images, or read an MJPEG stream from an "\
+                     "http:// address, instead of the drone's camera."
+        replay_mode_help = "How fast to replay the video. Use 'realtime' for "\
+                           "the rate of the video, 'fixed' for the replay rate "\
+                           "or 'fast' for as fast as the frames are used."
+        replay_rate_help = 'The frames per second of the replayed video.'
+        control_rate_help = 'The ticks per second of the control loop.'
+        latency_help = 'Print the latencies of each stage from capture to '\
+                       'command every given number of seconds while flying. '\
+                       'They are always printed when the flight ends.'
+        frame_format_help = "How to record the frames. Use 'jpg' for a JPEG "\
+                            "file per time step or 'pack' to pack them into "\
+                            "one file with an index."
+        record_policy_help = "What to do with a time step when the recorder "\
+                             "is backed up. Use 'block' to wait for it or "\
+                             "'drop' to drop the time step."
+        processes_help = "The number of processes extracting the Hough "\
+                         "transform and Law's mask features of the windows. "\
+                         "Default is to extract them on the feature "\
+                         "extraction thread."
 
         # Argparser.
         self.arg_parser = argparse.ArgumentParser(prog=name, description=desc, epilog=epil, add_help=False)
@@ -86,6 +110,15 @@ class FlyArgs(object):
         exec_parser = subparsers.add_parser('exec', help=train_help, add_help=False)
         exec_opt_args = exec_parser.add_argument_group('Optional arguments', '')
         exec_opt_args.add_argument('-h', '--help', action='help', help=help_help)
+        exec_opt_args.add_argument('-d', '--decode', type=str, choices=['always', 'demand'], default='always', help=decode_help)
+        exec_opt_args.add_argument('--video', type=str, default=None, help=video_help)
+        exec_opt_args.add_argument('--replay-mode', type=str, choices=['realtime', 'fixed', 'fast'], default='realtime', help=replay_mode_help)
+        exec_opt_args.add_argument('--replay-rate', type=float, default=None, help=replay_rate_help)
+        exec_opt_args.add_argument('--control-rate', type=float, default=15.0, help=control_rate_help)
+        exec_opt_args.add_argument('--latency', type=float, default=None, metavar='SECONDS', help=latency_help)
+        exec_opt_args.add_argument('--frame-format', type=str, choices=['jpg', 'pack'], default='jpg', help=frame_format_help)
+        exec_opt_args.add_argument('--record-policy', type=str, choices=['block', 'drop'], default='block', help=record_policy_help)
+        exec_opt_args.add_argument('--processes', type=int, default=None, help=processes_help)
 
         exec_pos_args = exec_parser.add_argument_group('Training arguments', '')
         exec_pos_args.add_argument('address', type=str, nargs=2, help=address_help)
@@ -114,6 +147,8 @@ class FlyArgs(object):
             self._parse_learning()
             self._parse_iteration()
             self._parse_trajectory()
+            if self.args.command == 'exec':
+                self._parse_replay()
         elif self.args.command == 'annotate':
             self._parse_iteration()
             self._parse_trajectory()
@@ -145,6 +180,12 @@ class FlyArgs(object):
             except ValueError:
                 raise debug.Error('args', 'the address of the %s server does not have a valid port' % server)
 
+    def _parse_replay(self):
+        if self.args.replay_mode == 'fixed' and self.args.replay_rate is None:
+            raise debug.Error('args', "the 'fixed' replay mode needs a replay rate")
+        if self.args.control_rate <= 0:
+            raise debug.Error('args', 'control rate %s is not positive' % self.args.control_rate)
+
     def _parse_learning(self):
         learning = self.args.learning
         if learning != 'tikhonov' and learning != 'ordinary_least_squares':
@@ -5,35 +5,155 @@
 
 import cv2
 import debug
+import latency
 import math
 import threading
+import time
 import Queue
 
+from frame import Frame
+
+
+class FrameMailbox(object):
+    """ Holds the newest frame from a camera.
+
+        Every new frame replaces the previous one, so whoever gets a frame
+        always gets the newest one. Each frame is given a sequence number and
+        its capture time, and a consumer can wait for a frame newer than the
+        last one it saw.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.seq = 0
+        self.taken = 0
+        self.waiting = 0
+        self.closed = False
+
+    def put(self, image, timestamp=None):
+        """ Replaces the frame with the image and returns its sequence number.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.condition:
+            self.seq += 1
+            self.frame = Frame(image, self.seq, timestamp)
+            self.frame.trace = latency.Trace(timestamp)
+            self.frame.trace.mark('retrieve')
+            self.condition.notify_all()
+        return self.seq
+
+    def get(self, newer_than=0, timeout=None):
+        """ Waits for a frame with a sequence number greater than newer_than
+            and returns the newest frame, or None if the timeout runs out or
+            the mailbox is closed.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            self.waiting += 1
+            try:
+                while self.seq <= newer_than:
+                    if self.closed:
+                        return None
+                    if deadline is None:
+                        self.condition.wait()
+                    else:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            return None
+                        self.condition.wait(remaining)
+                self.taken = self.seq
+                self.condition.notify_all()
+                return self.frame
+            finally:
+                self.waiting -= 1
+
+    def wait_taken(self, seq, timeout=None):
+        """ Waits until a consumer has gotten the frame with the sequence
+            number seq (or a newer one). Returns whether it has.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.taken < seq and not self.closed:
+                if deadline is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+            return self.taken >= seq
+
+    def close(self):
+        """ Marks the end of the stream and wakes up the waiting consumers.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def is_wanted(self):
+        """ Whether a consumer is waiting for a new frame.
+        """
+        return self.waiting > 0
+
 
 class Camera(threading.Thread):
     """ Encapsulates the camera on the AR Parrot Drone 2.0. Handles the
-        receiving of images from the drone using OpenCV.
+        receiving of images from the drone using OpenCV and puts each one in
+        the frame mailbox as soon as it is decoded.
+
+        Every packet of the stream is grabbed to keep up with it, but with
+        decode set to 'demand' a frame is only retrieved (converted and
+        copied out of the decoder) while a consumer is waiting on the mailbox,
+        so frames nobody reads are never retrieved. With decode set to
+        'always' every frame is retrieved into a new image, which its
+        consumers own.
+
+        In 'demand' mode frames are retrieved into a pool of pool_size
+        reusable buffers instead. A new frame is only retrieved while a
+        consumer waits for one, so a frame's image is overwritten once the
+        consumers have asked for about pool_size more frames. The flying tool
+        holds a frame until its features are extracted and the recorder copies
+        the images it keeps, so a few buffers cover every consumer; a consumer
+        keeping frames longer must copy them.
     """
-    def __init__(self, debug_queue, error_queue, address, queue):
+    def __init__(self, debug_queue, error_queue, address, mailbox, decode='always', pool_size=8):
         threading.Thread.__init__(self)
         self.debug_queue = debug_queue
         self.error_queue = error_queue
         self.address = address
-        self.queue = queue
+        self.mailbox = mailbox
+        self.decode = decode
+        self.pool_size = pool_size
 
     def run(self):
         cap = self.get_cap()
+        pool = []
+        i = 0
         while cap.isOpened():
-            (ret, frame) = cap.read()
+            if not cap.grab():
+                cap.release()
+                self.mailbox.close()
+                break
+            timestamp = time.time()
+            if self.decode == 'demand' and not self.mailbox.is_wanted():
+                continue
+
+            # On demand, retrieve into the next buffer of the pool, creating
+            # the pool from the first frame.
+            if self.decode != 'demand':
+                (ret, frame) = cap.retrieve()
+            elif pool:
+                (ret, frame) = cap.retrieve(pool[i])
+                i = (i + 1) % self.pool_size
+            else:
+                (ret, frame) = cap.retrieve()
+                if ret:
+                    pool = [frame] + [frame.copy() for _ in range(1, self.pool_size)]
+                    i = 1 % self.pool_size
             # If the image needs to converted to PIL, uncomment this line.
             # frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             if ret:
-                try:
-                    self.queue.put(frame, block=False)
-                except Queue.Full:
-                    pass
-            else:
-                cap.release()
+                self.mailbox.put(frame, timestamp)
 
     def get_cap(self):
         return cv2.VideoCapture(self.address)
@@ -57,17 +177,19 @@ def _test_get_image():
     debugger = debug.Debug(verbosity, debug_queue, error_queue)
 
     # Make sure the images look right.
-    image_queue = Queue.Queue(maxsize=1)
+    mailbox = FrameMailbox()
     camera_address = 'tcp://192.168.1.1:5555'
-    camera = Camera(debug_queue, error_queue, camera_address, image_queue)
+    camera = Camera(debug_queue, error_queue, camera_address, mailbox)
     camera.daemon = True
     camera.start()
 
     try:
         i = 0
+        seq = 0
         while True:
             debugger.debug()
-            image = image_queue.get(block=True)
+            frame = mailbox.get(newer_than=seq)
+            (image, seq) = (frame.image, frame.seq)
             cv2.imshow('image', image)
             key = cv2.waitKey(1) & 0xff
             if key == ord('q'):
@@ -1,19 +1,67 @@
 #!/usr/bin/env python2
 
+import collections
 import debug
 import errno
+import json
 import socket
+import threading
+import time
 
 
 class Controller(object):
     """ Handles the sending of commands to the drone.
+
+        Each command is sent as a line of JSON with a sequence number 'SEQ',
+        on a socket with Nagle's algorithm turned off, and the server replies
+        with a line acknowledging the sequence number once it has carried out
+        the command. A background thread reads the acknowledgements and keeps
+        the round trip latency.
+
+        If coalesce is set, a command the same as the last one sent is not
+        sent again, unless it takes off, lands, switches the camera or stops,
+        since the drone keeps flying at the last speeds it was given.
+
+        If loop is given, the commands are written and the acknowledgements
+        read by that event loop instead, and send_cmd never blocks. Commands
+        waiting to be written while the socket is backed up are replaced by
+        newer ones, except for the ones which take off, land, switch the
+        camera or stop.
     """
-    def __init__(self, debug_queue, error_queue):
+    def __init__(self, debug_queue, error_queue, coalesce=True, loop=None):
         self.debug_queue = debug_queue
         self.error_queue = error_queue
+        self.bufsize = 4096
+        self.coalesce = coalesce
+        self.loop = loop
+
+        # Bytes received after the last complete acknowledgement.
+        self.pending = ''
+
+        # Commands waiting to be written by the event loop, as (sequence
+        # number, message, whether it is an action) tuples, and the unwritten
+        # rest of the one being written.
+        self.outbox = collections.deque()
+        self.out = ''
+        self.writing = False
+
+        # The last command sent and its sequence number.
+        self.last_cmd = None
+        self.seq = 0
+
+        # Send times of the commands waiting to be acknowledged, and the round
+        # trip latency of the last acknowledged command and its average.
+        self.lock = threading.Lock()
+        self.sent = {}
+        self.acked = 0
+        self.latency = None
+        self.mean_latency = None
+        self.num_acks = 0
+        self.closed = False
 
         try:
             self.cmd_soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.cmd_soc.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             self.cmd_soc.connect(('localhost', 9000))
 
         except socket.error as e:
@@ -22,8 +70,164 @@ class Controller(object):
             if e[0] == errno.EPIPE:
                 self.error_queue.put(debug.Error('controller', 'bad pipe to command server'))
 
+        if self.loop is not None:
+            self.cmd_soc.setblocking(0)
+            self.loop.add_reader(self.cmd_soc, self.on_readable)
+        else:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        """ Reads the acknowledgements until the connection closes.
+        """
+        try:
+            while self.read_acks():
+                pass
+        except socket.error as e:
+            self.error_queue.put(debug.Error('controller', 'command acknowledgements failed: %s' % e))
+        except (ValueError, KeyError):
+            self.error_queue.put(debug.Error('controller', 'received acknowledgement is not valid'))
+
+    def on_readable(self):
+        """ Reads the acknowledgements when the event loop finds the socket
+            readable.
+        """
+        try:
+            if self.read_acks():
+                return
+        except socket.error as e:
+            if e[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.error_queue.put(debug.Error('controller', 'command acknowledgements failed: %s' % e))
+        except (ValueError, KeyError):
+            self.error_queue.put(debug.Error('controller', 'received acknowledgement is not valid'))
+        self.loop.remove_reader(self.cmd_soc)
+
+    def read_acks(self):
+        """ Receives acknowledgements from the server. Returns False once the
+            connection has closed.
+        """
+        data = self.cmd_soc.recv(self.bufsize)
+        if not data:
+            return False
+        lines = (self.pending + data).split('\n')
+        self.pending = lines.pop()
+        for line in lines:
+            if line:
+                self.ack(json.loads(line)['ACK'])
+        return True
+
+    def ack(self, seq):
+        now = time.time()
+        with self.lock:
+            sent_time = self.sent.pop(seq, None)
+            if sent_time is None:
+                return
+
+            # Commands sent before this one have been carried out too.
+            for old_seq in [s for s in self.sent if s < seq]:
+                del self.sent[old_seq]
+            self.acked = max(self.acked, seq)
+            self.latency = now - sent_time
+            self.num_acks += 1
+            if self.mean_latency is None:
+                self.mean_latency = self.latency
+            else:
+                self.mean_latency += (self.latency - self.mean_latency)/self.num_acks
+
+    def is_action(self, cmd):
+        return bool(cmd.get('T') or cmd.get('L') or cmd.get('C') or cmd.get('S'))
+
+    def is_redundant(self, cmd):
+        if not self.coalesce or self.last_cmd is None or self.is_action(cmd):
+            return False
+        return cmd == self.last_cmd
+
     def send_cmd(self, cmd):
-        self.cmd_soc.send(cmd)
+        """ Sends the command, a dictionary, to the drone. Returns its sequence
+            number, or None if it was coalesced with the last command.
+        """
+        if self.is_redundant(cmd):
+            return None
+        self.last_cmd = dict(cmd)
+        self.seq += 1
+        message = dict(cmd)
+        message['SEQ'] = self.seq
+        with self.lock:
+            self.sent[self.seq] = time.time()
+        if self.loop is not None:
+            self.loop.call_soon(self.write, self.seq, json.dumps(message) + '\n', self.is_action(cmd))
+            return self.seq
+        try:
+            self.cmd_soc.sendall(json.dumps(message) + '\n')
+        except socket.error as e:
+            # Resend the command next time.
+            self.last_cmd = None
+            with self.lock:
+                self.sent.pop(self.seq, None)
+            if e[0] == errno.EPIPE:
+                self.error_queue.put(debug.Error('controller', 'bad pipe to command server'))
+            else:
+                self.error_queue.put(debug.Error('controller', 'unable to send command: %s' % e))
+        return self.seq
+
+    def write(self, seq, message, action):
+        """ Queues the command to be written on the event loop's thread,
+            replacing the waiting commands it supersedes.
+        """
+        if self.closed:
+            # Commands queued before the socket was closed are dropped.
+            return
+        if not action:
+            superseded = [item for item in self.outbox if not item[2]]
+            for item in superseded:
+                self.outbox.remove(item)
+            with self.lock:
+                for item in superseded:
+                    self.sent.pop(item[0], None)
+        self.outbox.append((seq, message, action))
+        self.flush()
+
+    def flush(self):
+        """ Writes the waiting commands until the socket is backed up, and
+            then waits for the event loop to find it writable again.
+        """
+        try:
+            while self.out or self.outbox:
+                if not self.out:
+                    self.out = self.outbox.popleft()[1]
+                n = self.cmd_soc.send(self.out)
+                self.out = self.out[n:]
+        except socket.error as e:
+            if e[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.error_queue.put(debug.Error('controller', 'unable to send command: %s' % e))
+                # Resend the last command next time.
+                self.last_cmd = None
+                return
+            if not self.writing:
+                self.writing = True
+                self.loop.add_writer(self.cmd_soc, self.flush)
+            return
+        if self.writing:
+            self.writing = False
+            self.loop.remove_writer(self.cmd_soc)
+
+    def get_latency(self):
+        """ Gets the round trip latency of the last acknowledged command and
+            the average over all of them, in seconds (None until the first
+            acknowledgement).
+        """
+        with self.lock:
+            return (self.latency, self.mean_latency)
+
+    def close(self):
+        self.closed = True
+        if self.loop is not None:
+            # The loop stops watching the socket before it is closed.
+            self.loop.remove_reader(self.cmd_soc)
+            self.loop.remove_writer(self.cmd_soc)
+        self.cmd_soc.close()
 
 
 def _test_controller():
@@ -48,19 +252,16 @@ def _test_controller():
     }
     cmd = cmd_default.copy()
     cmd['T'] = True
-    cmd_json = json.dumps(cmd)
-    cmd_queue.put(cmd_json)
+    controller.send_cmd(cmd)
 
     time.sleep(2)
 
     cmd = cmd_default.copy()
     cmd['L'] = True
-    cmd_json = json.dumps(cmd)
-    cmd_queue.put(cmd_json)
+    controller.send_cmd(cmd)
+    print(controller.get_latency())
 
 if __name__ == '__main__':
     import pdb
-    import json
-    import time
     import Queue
     _test_controller()
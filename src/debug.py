@@ -3,8 +3,12 @@
 """ Debug module.
 """
 
+import collections
 import Queue
 import signal
+import sys
+import threading
+import time
 from contextlib import contextmanager
 
 
@@ -37,23 +41,114 @@ def time_limit(seconds):
         signal.alarm(0)
 
 
+def format_message(msg):
+    """ Formats a debug message. A message with 'ARGS' is only formatted here,
+        so the formatting is skipped for messages which are never printed.
+    """
+    if 'ARGS' in msg:
+        return msg['MSG'] % msg['ARGS']
+    return msg['MSG']
+
+
+class LogQueue(object):
+    """ Ring buffer of debug messages with the put and get of a Queue.
+
+        Messages with a priority below the verbosity are dropped by put before
+        they are stored, and put never blocks: when the buffer is full the
+        oldest message is dropped to make room, so a slow console can't hold
+        up whoever logs.
+    """
+    def __init__(self, verbosity=0, size=1024):
+        self.verbosity = verbosity
+        self.messages = collections.deque(maxlen=size)
+        self.condition = threading.Condition()
+        self.dropped = 0
+
+    def put(self, msg, block=True, timeout=None):
+        if msg is not None and msg['PRIORITY'] < self.verbosity:
+            return
+        with self.condition:
+            if len(self.messages) == self.messages.maxlen:
+                self.dropped += 1
+            self.messages.append(msg)
+            self.condition.notify()
+
+    def get(self, block=True, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while not self.messages:
+                if not block:
+                    raise Queue.Empty
+                if deadline is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Queue.Empty
+                    self.condition.wait(remaining)
+            return self.messages.popleft()
+
+    def qsize(self):
+        return len(self.messages)
+
+    def empty(self):
+        return not self.messages
+
+
 class Debug(object):
     """ Prints out debug information and logs it if need be.
+
+        If threaded is set the messages are printed by a writer thread as they
+        arrive, and debug only raises the errors, so printing never holds up
+        the caller. Otherwise debug prints the messages waiting in the queue.
     """
-    def __init__(self, verbosity, debug_queue, error_queue):
+    def __init__(self, verbosity, debug_queue, error_queue, threaded=False):
         self.verbosity = verbosity
         self.debug_queue = debug_queue
         self.error_queue = error_queue
 
-    def debug(self):
-        # Get all the messages in the queue and print them out.
+        self.writer = None
+        if threaded:
+            self.writer = threading.Thread(target=self.write)
+            self.writer.daemon = True
+            self.writer.start()
+
+    def log(self, priority, msg, *args):
+        """ Queues the message, to be formatted with the arguments only if it
+            is printed.
+        """
+        if priority >= self.verbosity:
+            self.debug_queue.put({'MSG': msg, 'ARGS': args, 'PRIORITY': priority})
+
+    def write(self):
+        """ Prints the messages as they arrive until the queue is closed.
+        """
         while True:
-            msg = None
+            msg = self.debug_queue.get(block=True)
+            if msg is None:
+                break
+            if msg['PRIORITY'] >= self.verbosity:
+                sys.stdout.write(format_message(msg) + '\n')
+            if self.debug_queue.empty():
+                sys.stdout.flush()
+        sys.stdout.flush()
+
+    def close(self, timeout=None):
+        """ Stops the writer thread once it has printed the queued messages.
+        """
+        if self.writer is not None:
+            self.debug_queue.put(None)
+            self.writer.join(timeout)
+
+    def debug(self):
+        # Get all the messages in the queue and print them out, unless the
+        # writer thread does.
+        while self.writer is None:
             try:
                 msg = self.debug_queue.get(block=False)
                 if msg is not None:
                     if msg['PRIORITY'] >= self.verbosity:
-                        print(msg['MSG'])
+                        print(format_message(msg))
             except Queue.Empty:
                 break
 
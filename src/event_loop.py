@@ -0,0 +1,193 @@
+#!/usr/bin/env python2
+
+""" Event loop module.
+"""
+
+import collections
+import debug
+import errno
+import heapq
+import itertools
+import os
+import select
+import socket
+import sys
+import threading
+import time
+
+
+class EventLoop(threading.Thread):
+    """ Runs the socket I/O of the drone on one thread.
+
+        Sockets are watched with select and a callback is run on the loop's
+        thread whenever a socket can be read or written, so the receiver and
+        the controller need neither threads of their own nor blocking calls.
+        Callbacks can also be run soon or after a delay. The loop is woken up
+        through a socket pair when it is given something to do from another
+        thread. Sockets stop being watched as soon as they are removed, so the
+        caller can close them right after, and a socket closed while still
+        watched is dropped without stopping the loop for the others.
+    """
+    def __init__(self, error_queue):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.error_queue = error_queue
+
+        self.readers = {}
+        self.writers = {}
+        self.calls = collections.deque()
+        self.timers = []
+        self.timer_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.closed = False
+
+        (self.wake_in, self.wake_out) = socket.socketpair()
+        self.wake_in.setblocking(0)
+        self.wake_out.setblocking(0)
+        self.readers[self.wake_in] = self.drain
+
+    def call_soon(self, callback, *args):
+        """ Runs the callback on the loop's thread as soon as possible. Can be
+            called from any thread.
+        """
+        self.calls.append((callback, args))
+        self.wake()
+
+    def call_later(self, delay, callback, *args):
+        """ Runs the callback on the loop's thread after delay seconds. Can be
+            called from any thread.
+        """
+        with self.lock:
+            heapq.heappush(self.timers, (time.time() + delay, next(self.timer_ids), callback, args))
+        self.wake()
+
+    def add_reader(self, soc, callback):
+        with self.lock:
+            self.readers[soc] = callback
+        self.wake()
+
+    def remove_reader(self, soc):
+        with self.lock:
+            self.readers.pop(soc, None)
+        self.wake()
+
+    def add_writer(self, soc, callback):
+        with self.lock:
+            self.writers[soc] = callback
+        self.wake()
+
+    def remove_writer(self, soc):
+        with self.lock:
+            self.writers.pop(soc, None)
+        self.wake()
+
+    def stop(self):
+        self.call_soon(setattr, self, 'closed', True)
+
+    def wake(self):
+        if threading.current_thread() is self or self.closed:
+            return
+        try:
+            self.wake_out.send('\0')
+        except socket.error as e:
+            # The loop may have stopped and closed the pair since the check.
+            if self.closed:
+                return
+            # The loop is already going to wake up if the pair is full.
+            if e[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def drain(self):
+        try:
+            while self.wake_in.recv(4096):
+                pass
+        except socket.error as e:
+            if e[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def run(self):
+        try:
+            self.run_loop()
+        finally:
+            self.closed = True
+            self.wake_in.close()
+            self.wake_out.close()
+
+    def run_loop(self):
+        while not self.closed:
+            # Run the calls queued so far, later ones wait for the next turn.
+            for _ in range(len(self.calls)):
+                (callback, args) = self.calls.popleft()
+                self.dispatch(callback, *args)
+            if self.closed:
+                break
+
+            with self.lock:
+                timeout = max(0.0, self.timers[0][0] - time.time()) if self.timers else None
+            if self.calls:
+                timeout = 0.0
+
+            with self.lock:
+                (readers, writers) = (list(self.readers), list(self.writers))
+            try:
+                (readable, writable, _) = select.select(readers, writers, [], timeout)
+            except (select.error, ValueError) as e:
+                # A ValueError means a watched socket was closed.
+                if isinstance(e, select.error) and e[0] == errno.EINTR:
+                    continue
+                if self.drop_closed():
+                    continue
+                # The sockets can't be watched anymore, so stop the loop.
+                self.error_queue.put(debug.Error('event_loop', 'select failed, %s' % (e,)))
+                break
+            for soc in readable:
+                with self.lock:
+                    callback = self.readers.get(soc)
+                if callback is not None:
+                    self.dispatch(callback)
+            for soc in writable:
+                with self.lock:
+                    callback = self.writers.get(soc)
+                if callback is not None:
+                    self.dispatch(callback)
+
+            # Run the timers that are due.
+            now = time.time()
+            while True:
+                with self.lock:
+                    if not self.timers or self.timers[0][0] > now:
+                        break
+                    (_, _, callback, args) = heapq.heappop(self.timers)
+                self.dispatch(callback, *args)
+
+    def drop_closed(self):
+        """ Stops watching the sockets that were closed without being
+            removed first. Returns whether any were found.
+        """
+        dropped = False
+        with self.lock:
+            for watched in (self.readers, self.writers):
+                for soc in list(watched):
+                    if not is_open(soc):
+                        del watched[soc]
+                        dropped = True
+        return dropped
+
+    def dispatch(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            exc_error = sys.exc_info()
+            self.error_queue.put(debug.Error('event_loop', '%s, %s, %s' % exc_error))
+
+
+def is_open(soc):
+    """ Checks whether the socket still has a valid file descriptor. """
+    try:
+        fd = soc.fileno()
+        if fd < 0:
+            return False
+        os.fstat(fd)
+    except (socket.error, OSError, ValueError):
+        return False
+    return True
@@ -0,0 +1,6 @@
+""" Feature extraction package.
+
+    The modules import the frame, debug and latency modules of the flying
+    tool from src, like fly.py does, so run their tests from src, e.g.
+    python2 -m feature_extraction.hough_transform.
+"""
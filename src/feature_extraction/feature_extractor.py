@@ -4,37 +4,104 @@
 """
 
 import math
+import sys
 import threading
+import time
 import Queue
 import cv2
 import numpy as np
 
+import debug
+import latency
+from frame import Frame, as_frame
+
 # Feature modules.
+import feature_layout
 import hough_transform
 import optical_flow
 import laws_mask
 import history
+import window_pool
 
 
 class FeatureExtractor(object):
-    def __init__(self, feature_queue, init_image, window_size, overlap, cmd_history_feats, cmd_history_length, nav_history_feats, nav_history_length):
+    """ Extracts the visual and history features of the drone.
+
+        Argument flow_mode can be 'window' to compute the optical flow of each
+        window separately or 'frame' to compute it once over the whole frame,
+        downscaled by flow_scale, and pool the flow features of each window.
+        Likewise laws_mode can be 'window' or 'frame' to filter the whole frame
+        once and read the Law's mask features of each window from integral
+        images, and hough_mode can be 'window' or 'frame' to find the lines of
+        the whole frame once and assign them to the windows.
+
+        Frames are extracted in order by a single long-lived worker thread
+        which puts (sequence number, features) tuples on the feature queue. At
+        most input_size frames wait to be extracted.
+
+        If window_pool is given (see create_window_pool), the Hough transform
+        and Law's mask features of the windows are extracted by its processes
+        while the flow is extracted by the worker thread. The extractor closes
+        the pool when it is stopped.
+    """
+    def __init__(self, feature_queue, init_image, window_size, overlap, cmd_history_feats, cmd_history_length, nav_history_feats, nav_history_length, flow_mode='window', flow_scale=0.5, laws_mode='window', hough_mode='window', input_size=1, error_queue=None, window_pool=None):
         self.feature_queue = feature_queue
-        self.init_image = init_image
+        self.error_queue = error_queue
+        self.init_image = as_frame(init_image).image
         self.window_size = window_size
         self.overlap = overlap
         self.cmd_history_feats = cmd_history_feats
         self.cmd_history_length = cmd_history_length
         self.nav_history_feats = nav_history_feats
         self.nav_history_length = nav_history_length
+        self.flow_mode = flow_mode
+        self.flow_scale = flow_scale
+        self.laws_mode = laws_mode
+        self.hough_mode = hough_mode
+        self.window_pool = window_pool
         self.init_feature_extract()
 
-    def extract(self, image):
-        t = threading.Thread(target=self.get_features, args=(image,))
-        t.start()
+        # The history is updated by the caller while the worker reads it.
+        self.history_lock = threading.Lock()
+        self.seq = 0
+
+        self.worker = ExtractionWorker(self, input_size)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def extract(self, image, block=True):
+        """ Queues the image to have its features extracted by the worker.
+
+            Returns the sequence number of the image, or None if the worker is
+            busy and block is False.
+        """
+        try:
+            self.worker.input_queue.put((self.seq + 1, image), block=block)
+        except Queue.Full:
+            return None
+        self.seq += 1
+        return self.seq
 
     def update(self, cmd, navdata):
-        self.extractor_nav_history.update(navdata)
-        self.extractor_cmd_history.update(cmd)
+        with self.history_lock:
+            self.extractor_nav_history.update(navdata)
+            self.extractor_cmd_history.update(cmd)
+
+    def stop(self, timeout=5.0):
+        """ Stops the worker once the images already queued are extracted,
+            waiting at most about timeout seconds for it. The worker gives up
+            on features nobody takes off the feature queue once it is stopped.
+        """
+        deadline = time.time() + timeout
+        self.worker.stopped.set()
+        try:
+            self.worker.input_queue.put(None, timeout=timeout)
+        except Queue.Full:
+            # The worker died and left the input queue full.
+            pass
+        self.worker.join(max(0.0, deadline - time.time()))
+        if self.window_pool is not None:
+            self.window_pool.close()
 
     def init_feature_extract(self):
         # Grab an example window from the initial image to feed the optical flow
@@ -43,67 +110,185 @@ class FeatureExtractor(object):
         small_image = self.init_image[windows[1][1][2]:windows[1][1][3], windows[1][1][0]:windows[1][1][1]]
 
         # Initialize each feature extractor.
-        self.extractor_opt_flow = optical_flow.OpticalFlow(small_image)
+        self.window_shape = small_image.shape[:2]
+        if self.flow_mode == 'window':
+            self.extractor_opt_flow = optical_flow.OpticalFlow(small_image)
+        elif self.flow_mode == 'frame':
+            self.extractor_opt_flow = optical_flow.OpticalFlow(self.init_image, scale=self.flow_scale)
         self.extractor_hough_trans = hough_transform.HoughTransform()
         self.extractor_laws_mask = laws_mask.LawsMask()
         self.extractor_cmd_history = history.CmdHistory(self.cmd_history_feats, self.cmd_history_length)
         self.extractor_nav_history = history.NavHistory(self.nav_history_feats, self.nav_history_length)
 
+        # Create the layout of the features and the buffer they are put in.
+        num_windows = self.window_size[0]*self.window_size[1]
+        self.layout = feature_layout.FeatureLayout.create(num_windows,
+                                                          len(self.extractor_cmd_history.spacing),
+                                                          len(self.extractor_nav_history.spacing))
+        self.features = self.layout.new_buffer()
+        self.feats_flow = self.layout.get_view(self.features, 'flow')
+        self.feats_hough = self.layout.get_view(self.features, 'hough')
+        self.feats_laws = self.layout.get_view(self.features, 'laws')
+        self.feats_cmd_history = self.layout.get_view(self.features, 'cmd_history')
+        self.feats_nav_history = self.layout.get_view(self.features, 'nav_history')
+
     def get_visual_features(self, image):
+        """ Fills the visual features of the feature buffer.
+        """
+        # Share the color conversions of the frame between the extractors.
+        frame = as_frame(image)
+        image = frame.image
+        trace = frame.trace
+
         # Get the windows from the current image.
         windows = get_windows(image, self.window_size, self.overlap)
 
-        # Arrays that will contain the different features.
-        feats_all = np.array([])
-        feats_flow = np.array([])
-        feats_hough = np.array([])
-        feats_laws = np.array([])
-
-        # Iterate through the windows, computing features for each.
-        for r in range(0, self.window_size[1]):
-            for c in range(0, self.window_size[0]):
-                # Get the current window of the image for which the features
-                # will be extracted from.
-                cur_window = image[windows[r][c][2]:windows[r][c][3], windows[r][c][0]:windows[r][c][1]]
-
-                # If the current window is a border window, it may have a
-                # smaller size, so reshape it.
-                cur_window = cv2.resize(cur_window, self.extractor_opt_flow.shape[::-1])
-
-                # Get the optical flow features from the current window.
-                flow = self.extractor_opt_flow.extract(cur_window)
-                feats_cur = optical_flow.OpticalFlow.get_features(flow)
-                feats_flow = np.vstack((feats_flow, feats_cur)) if feats_flow.size else feats_cur
-
-                # Get the Hough transform features from the current window.
-                lines = self.extractor_hough_trans.extract(cur_window)
-                feats_cur = hough_transform.HoughTransform.get_features(lines)
-                feats_hough = np.vstack((feats_hough, feats_cur)) if feats_hough.size else feats_cur
-
-                # Get the Law's texture mask features from the current window.
-                feats_cur = self.extractor_laws_mask.extract(cur_window)
-                feats_laws = np.vstack((feats_laws, feats_cur)) if feats_laws.size else feats_cur
-
-        # Vertically stack all of the different features.
-        feats_all = np.vstack((feats_all, feats_flow)) if feats_all.size else feats_flow
-        feats_all = np.vstack((feats_all, feats_hough)) if feats_all.size else feats_hough
-        feats_all = np.vstack((feats_all, feats_laws)) if feats_all.size else feats_laws
-
-        # Transpose and return.
-        return np.transpose(feats_all)
+        # Let the process pool extract the Hough transform and Law's mask
+        # features while the flow is extracted here.
+        if self.window_pool is not None:
+            result = self.window_pool.extract_async(image, windows, self.window_shape)
+
+        # Compute the flow once for the whole frame and pool it for each window.
+        if self.flow_mode == 'frame':
+            with latency.timed(trace, 'flow'):
+                flow = self.extractor_opt_flow.extract(frame)
+                feats_cur = optical_flow.OpticalFlow.get_window_features(flow, windows, self.flow_scale)
+                self.feats_flow[...] = feats_cur.reshape(self.feats_flow.shape)
+
+        # Find the lines and filter the whole frame once for the Hough
+        # transform and Law's mask features.
+        if self.hough_mode == 'frame' or self.laws_mode == 'frame':
+            bounds = get_window_bounds(image, windows)
+        if self.hough_mode == 'frame':
+            with latency.timed(trace, 'hough'):
+                self.feats_hough[...] = self.extractor_hough_trans.extract_windows(frame, bounds)
+        if self.laws_mode == 'frame':
+            with latency.timed(trace, 'laws'):
+                self.feats_laws[...] = self.extractor_laws_mask.extract_windows(frame, bounds, convert=True)
+
+        # Iterate through the windows, computing the features for each which
+        # are not extracted for the whole frame or by the process pool.
+        window_hough = self.hough_mode == 'window' and self.window_pool is None
+        window_laws = self.laws_mode == 'window' and self.window_pool is None
+        if self.flow_mode == 'window' or window_hough or window_laws:
+            for r in range(0, self.window_size[1]):
+                for c in range(0, self.window_size[0]):
+                    i = r*self.window_size[0] + c
+
+                    # Get the current window of the image for which the features
+                    # will be extracted from.
+                    cur_window = image[windows[r][c][2]:windows[r][c][3], windows[r][c][0]:windows[r][c][1]]
+
+                    # If the current window is a border window, it may have a
+                    # smaller size, so reshape it.
+                    cur_window = Frame(cv2.resize(cur_window, self.window_shape[::-1]), frame.seq, frame.timestamp)
+
+                    # Get the optical flow features from the current window.
+                    if self.flow_mode == 'window':
+                        with latency.timed(trace, 'flow'):
+                            flow = self.extractor_opt_flow.extract(cur_window)
+                            self.feats_flow[i] = optical_flow.OpticalFlow.get_features(flow)[:, 0]
+
+                    # Get the Hough transform features from the current window.
+                    if window_hough:
+                        with latency.timed(trace, 'hough'):
+                            lines = self.extractor_hough_trans.extract(cur_window)
+                            self.feats_hough[i] = hough_transform.HoughTransform.get_features(lines)[:, 0]
+
+                    # Get the Law's texture mask features from the current window.
+                    if window_laws:
+                        with latency.timed(trace, 'laws'):
+                            self.feats_laws[i] = self.extractor_laws_mask.extract(cur_window, convert=True)[:, 0]
+
+        # Collect the features from the process pool (re-raises its errors).
+        if self.window_pool is not None:
+            with latency.timed(trace, 'window pool wait'):
+                result.get()
+            if self.hough_mode == 'window':
+                self.feats_hough[...] = self.window_pool.get_hough_features()
+            if self.laws_mode == 'window':
+                self.feats_laws[...] = self.window_pool.get_laws_features()
 
     def get_nav_features(self):
-        # Get the command and navigation data history features.
-        feats_cmd_history = self.extractor_cmd_history.extract()
-        feats_nav_history = self.extractor_nav_history.extract()
-        feats_all = np.vstack((feats_cmd_history, feats_nav_history))
-        return np.transpose(feats_all)
+        """ Fills the command and navigation data history features of the
+            feature buffer.
+        """
+        with self.history_lock:
+            feats_cmd_history = self.extractor_cmd_history.extract()
+            feats_nav_history = self.extractor_nav_history.extract()
+        self.feats_cmd_history[...] = feats_cmd_history.reshape(self.feats_cmd_history.shape)
+        self.feats_nav_history[...] = feats_nav_history.reshape(self.feats_nav_history.shape)
 
     def get_features(self, image):
-        visual_features = self.get_visual_features(image)
-        nav_features = self.get_nav_features()
-        feats = np.hstack((visual_features, nav_features))
-        self.feature_queue.put(feats)
+        """ Extracts all of the features of the image (or Frame) into the
+            feature buffer and returns it. The buffer is reused by the next extraction, so
+            copy it to keep the features.
+        """
+        self.get_visual_features(image)
+        self.get_nav_features()
+        return self.features
+
+
+class ExtractionWorker(threading.Thread):
+    """ Long-lived thread which extracts the features of the queued images one
+        at a time, so the state of the extractors is never shared between
+        concurrent extractions and the features come out in order.
+    """
+    def __init__(self, extractor, input_size):
+        threading.Thread.__init__(self)
+        self.extractor = extractor
+        self.input_queue = Queue.Queue(maxsize=input_size)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while True:
+            item = self.input_queue.get(block=True)
+            if item is None:
+                break
+            (seq, image) = item
+            try:
+                feats = self.extractor.get_features(image)
+                if isinstance(image, Frame) and image.trace is not None:
+                    image.trace.mark('features')
+            except Exception:
+                if self.extractor.error_queue is None:
+                    raise
+                exc_error = sys.exc_info()
+                self.extractor.error_queue.put(debug.Error('feature_extractor', '%s, %s, %s' % exc_error))
+                break
+            if not self.put((seq, feats.copy())):
+                break
+
+    def put(self, item):
+        """ Puts the item on the feature queue, waiting for room unless the
+            worker is stopped. Returns whether it was put.
+        """
+        while True:
+            try:
+                self.extractor.feature_queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                if self.stopped.is_set():
+                    return False
+
+
+def create_window_pool(window_size, processes, hough_mode='window', laws_mode='window'):
+    """ Creates the pool of processes extracting the Hough transform and Law's
+        mask features of the windows which are not extracted for the whole
+        frame, or returns None if processes is not given or there are no such
+        features.
+
+        The processes are forked, so create the pool before starting any
+        thread (the camera, event loop and debug writer threads included).
+    """
+    extractors = []
+    if hough_mode == 'window':
+        extractors.append('hough')
+    if laws_mode == 'window':
+        extractors.append('laws')
+    if not processes or not extractors:
+        return None
+    return window_pool.WindowPool(window_size[0]*window_size[1], processes, extractors)
 
 
 def get_windows(image, window_size, percent_overlap):
@@ -132,6 +317,18 @@ def get_windows(image, window_size, percent_overlap):
     return windows
 
 
+def get_window_bounds(image, windows):
+    """ Gets the windows of the image as an array with a (x_start, x_end,
+        y_start, y_end) row per window, in row major order, clipped to the
+        image.
+    """
+    (y, x, _) = image.shape
+    bounds = np.array([w for row in windows for w in row], dtype=np.intp)
+    bounds[:, 0:2] = np.clip(bounds[:, 0:2], 0, x)
+    bounds[:, 2:4] = np.clip(bounds[:, 2:4], 0, y)
+    return bounds
+
+
 def _test_feature_extractor():
     pdb.set_trace()
 
@@ -154,16 +351,9 @@ def _test_feature_extractor():
                           nav_history_length)
     
     pdb.set_trace()
-    fe.extract(init_image, '', '')
-
-    while True:
-        blah = None
-        try:
-            blah = feature_queue.get(block=False)
-        except Queue.Empty:
-            pass
-        if blah is not None:
-            break
+    fe.extract(init_image)
+    (seq, feats) = feature_queue.get(block=True)
+    fe.stop()
 
     print('Success.')
 
@@ -0,0 +1,77 @@
+#!/usr/bin/env python2.7
+
+""" Layout of the feature vector built by the feature extractor.
+"""
+
+import numpy as np
+
+
+# Names of the features each extractor outputs for a window or time period.
+FLOW_FEATS = ['MIN', 'MAX', 'MEAN', 'STDX', 'STDY']
+HOUGH_FEATS = ['X1', 'Y1', 'X2', 'Y2']
+LAWS_FEATS = ['Y_LL', 'Cr_LL', 'Cb_LL', 'Y_LE', 'Y_LS', 'Y_EE', 'Y_ES', 'Y_SS']
+CMD_HISTORY_FEATS = ['X', 'Y', 'Z', 'R']
+NAV_HISTORY_FEATS = ['ALTITUDE', 'PITCH', 'ROLL', 'YAW']
+
+
+class FeatureLayout(object):
+    """ Knows where the features of each extractor live in the feature vector.
+
+        The layout is made of named blocks in order, each holding count rows of
+        the features given by names (e.g. the flow features of every window).
+        A block is stored row by row, the same as stacking the feature columns
+        of each row on top of each other.
+    """
+    def __init__(self, blocks):
+        self.blocks = []
+        self.slices = {}
+        self.shapes = {}
+        self.names = {}
+        start = 0
+        for (block, count, names) in blocks:
+            stop = start + count*len(names)
+            self.blocks.append(block)
+            self.slices[block] = slice(start, stop)
+            self.shapes[block] = (count, len(names))
+            self.names[block] = names
+            start = stop
+        self.size = start
+
+    @staticmethod
+    def create(num_windows, num_cmd_history, num_nav_history):
+        """ Creates the layout of the features of the feature extractor.
+        """
+        return FeatureLayout([('flow', num_windows, FLOW_FEATS),
+                              ('hough', num_windows, HOUGH_FEATS),
+                              ('laws', num_windows, LAWS_FEATS),
+                              ('cmd_history', num_cmd_history, CMD_HISTORY_FEATS),
+                              ('nav_history', num_nav_history, NAV_HISTORY_FEATS)])
+
+    def new_buffer(self):
+        """ Creates a feature vector with shape (1, size) to be filled in place.
+        """
+        return np.zeros((1, self.size))
+
+    def get_slice(self, block):
+        """ Gets the columns of the feature vector which hold the block.
+        """
+        return self.slices[block]
+
+    def get_view(self, buf, block):
+        """ Gets a (count, number of features) view of the block in the
+            feature vector which writes through to it.
+        """
+        view = buf[0, self.slices[block]]
+        view.shape = self.shapes[block]
+        return view
+
+    def get_column_names(self):
+        """ Gets a name for every column of the feature vector, such as
+            'flow_3_MEAN' for the mean flow of the fourth window.
+        """
+        columns = []
+        for block in self.blocks:
+            (count, _) = self.shapes[block]
+            for i in range(0, count):
+                columns.extend(['%s_%s_%s' % (block, i, name) for name in self.names[block]])
+        return columns
@@ -35,118 +35,215 @@ def low_pass_average(array, spacing):
     return result
 
 
-def low_pass_sinc_window(array, spacing):
-    """ Passes an array through a sinc-window low pass filter.
+def sinc_kernel(fc, N):
+    """ Creates a causal windowed-sinc low pass filter with a cutoff frequency
+        fc (a fraction of the sample rate) and N taps, newest sample first.
+
+        The kernel is the half of the sinc from the newest sample back,
+        tapered by the falling half of a Blackman window, so it reads only the
+        last N samples and follows the signal with no more delay than an
+        average over them.
     """
-    fc = 0.1                        # cutoff frequency (fraction of sample rate)
-    b = 0.01                        # transition bandwidth
-    N = int(np.ceil((4/b)))
-    N = N if N % 2 else N + 1       # make sure N is odd
     n = np.arange(N)
 
     # Compute sinc filter.
-    h = np.sinc(2 * fc * (n - (N - 1) / 2.))
+    h = np.sinc(2 * fc * n)
 
-    # Compute Blackman window.
-    w = 0.42 - 0.5 * np.cos(2 * np.pi * n / (N - 1)) + \
-        0.08 * np.cos(4 * np.pi * n / (N - 1))
+    # Compute the falling half of a Blackman window of 2N + 1 points, which
+    # reaches zero just past the last tap.
+    m = n + N
+    w = 0.42 - 0.5 * np.cos(2 * np.pi * m / (2 * N)) + \
+        0.08 * np.cos(4 * np.pi * m / (2 * N))
 
     # Multiply sinc filter with window.
     h = h * w
 
     # Normalize to get unity gain.
     h = h/np.sum(h)
+    return h
 
-    result = []
-    length = spacing.shape
-    length = length[0]
-    for i in range(0, length):
-        time_slice = array[:, 0:spacing[i]]
-        if time_slice.shape[1] == 1:
-            result = np.vstack((result, time_slice)) if len(result) else time_slice
+
+def get_sinc_kernels(spacing, N):
+    """ Creates a causal windowed-sinc kernel of N taps for each time period
+        of the spacing, with a cutoff of half a cycle per period (the same
+        bandwidth as an average over the period). Periods of one sample pass
+        the newest sample through. Returns an array with a row of taps per
+        time period.
+    """
+    kernels = np.zeros((len(spacing), N))
+    for (i, period) in enumerate(spacing):
+        if period <= 1:
+            kernels[i, 0] = 1.0
         else:
-            # Convolve the filter with the signal.
-            conv = np.convolve(array, h)
+            kernels[i] = sinc_kernel(0.5/period, N)
+    return kernels
+
+
+def low_pass_sinc_window(array, spacing):
+    """ Passes an array through a sinc-window low pass filter for each time
+        period of the spacing and returns the filtered value at the newest
+        time step, stacked time period by time period.
 
-            conv.shape = (conv.shape[0], 1)
-            result = np.vstack((result, conv))
+        The array has a row per signal and a column per time step, newest
+        first, and the kernels have a tap per column.
+    """
+    kernels = get_sinc_kernels(spacing, array.shape[1])
+    result = np.zeros((len(spacing), array.shape[0]))
+    for i in range(0, len(spacing)):
+        for j in range(0, array.shape[0]):
+            # Convolve the filter with the signal, oldest first, and keep the
+            # output at the newest time step.
+            signal = array[j, ::-1]
+            conv = np.convolve(signal, kernels[i])
+            result[i, j] = conv[len(signal) - 1]
+    result.shape = (result.size, 1)
     return result
 
 
-class CmdHistory(object):
-    """ Command history features.
+class SincFilter(object):
+    """ Streaming windowed-sinc low pass filters of the last length samples
+        for each time period of the spacing.
+
+        The kernels are computed once and the last samples are kept in a
+        doubled ring buffer, so the samples under the kernels are always a
+        contiguous, newest first block and each update is two row writes.
     """
-    def __init__(self, num_feats, max_length):
+    def __init__(self, spacing, num_signals, length):
+        self.kernels = get_sinc_kernels(spacing, length)
+        self.taps = length
+        self.buffer = np.zeros((2*self.taps, num_signals))
+        self.pos = 0
+        self.feats = np.zeros((len(spacing), num_signals))
+
+    def push(self, sample):
+        self.pos = (self.pos - 1) % self.taps
+        self.buffer[self.pos] = sample
+        self.buffer[self.pos + self.taps] = sample
+
+    def extract(self):
+        """ Gets the filtered signals at the newest time step, with a row per
+            time period. The array is overwritten by the next extraction.
+        """
+        window = self.buffer[self.pos:self.pos + self.taps]
+        np.dot(self.kernels, window, out=self.feats)
+        return self.feats
+
+
+class History(object):
+    """ History of the last max_length samples of a few signals.
+
+        The samples are kept in a fixed size ring buffer together with a
+        running sum of each of the time periods given by the spacing, so
+        updating the history and extracting the average features take
+        constant time and allocate nothing, however long the history is. The
+        sums are recomputed from the buffer once per max_length updates to
+        keep rounding errors from building up.
+    """
+    def __init__(self, num_feats, max_length, num_signals=4):
         self.num_feats = num_feats
         self.max_length = max_length
-        self.history = np.zeros((4, max_length))
 
         # Create the spacing for the exponentially decreasing time periods.
         self.spacing = get_spacing(self.max_length, self.num_feats, func='log')
+        self.periods = np.clip(self.spacing, 1, self.max_length)
+
+        # Ring buffer of samples, newest at row pos, and running period sums.
+        self.buffer = np.zeros((self.max_length, num_signals))
+        self.pos = 0
+        self.count = 0
+        self.sums = np.zeros((len(self.periods), num_signals))
+
+        # Preallocated scratch space and features.
+        self.leave_rows = np.zeros(len(self.periods), dtype=np.intp)
+        self.leaving = np.zeros((len(self.periods), num_signals))
+        self.feats = np.zeros((len(self.periods), num_signals))
+        self.inv_periods = 1.0/self.periods[:, None]
+
+        # Streaming state of the sinc filters, which read the same samples as
+        # the history.
+        self.sinc = SincFilter(self.periods, num_signals, self.max_length)
+
+    def push(self, sample):
+        """ Adds the newest sample of the signals to the history.
+        """
+        self.pos = (self.pos + 1) % self.max_length
+
+        # Subtract the samples which fall out of each period from its sum. For
+        # the longest period that is the sample about to be overwritten.
+        np.subtract(self.pos, self.periods, out=self.leave_rows)
+        np.mod(self.leave_rows, self.max_length, out=self.leave_rows)
+        np.take(self.buffer, self.leave_rows, axis=0, out=self.leaving)
+        np.subtract(sample, self.leaving, out=self.leaving)
+        np.add(self.sums, self.leaving, out=self.sums)
+        self.buffer[self.pos] = sample
+        self.sinc.push(sample)
+
+        self.count += 1
+        if self.count % self.max_length == 0:
+            self.refresh()
+
+    def refresh(self):
+        """ Recomputes the period sums from the buffer.
+        """
+        for (i, period) in enumerate(self.periods):
+            rows = (self.pos - np.arange(period)) % self.max_length
+            self.sums[i] = np.sum(self.buffer[rows], axis=0)
 
-    def update(self, cmd, form=False):
-        """ Updates the history with the specified command.
-
-            Argument form specifies specifies whether the command has been
-            transformed into a col vector or whether it is the same form as that
-            which is sent to the drone.
+    def get_history(self):
+        """ Gets the history as an array with a row per signal and a column per
+            time step, newest first.
         """
-        self.history = np.roll(self.history, 1)
-        cmd_vec = cmd if form else np.transpose(np.array([cmd['X'], cmd['Y'], cmd['Z'], cmd['R']]))
-        self.history[:, 0] = cmd_vec
+        rows = (self.pos - np.arange(self.max_length)) % self.max_length
+        return np.transpose(self.buffer[rows])
 
     def extract(self, low_pass_filter='average'):
-        """ Extracts the command history features.
+        """ Extracts the history features, stacked time period by time period.
+            The features are a view of a buffer which is overwritten by the
+            next extraction.
 
             Filter can be 'average' or 'sinc'.
         """
         if low_pass_filter == 'average':
-            func = low_pass_average
+            np.multiply(self.sums, self.inv_periods, out=self.feats)
+            return self.feats.reshape((self.feats.size, 1))
         elif low_pass_filter == 'sinc':
-            func = low_pass_sinc_window
-        feats = func(self.history, self.spacing)
-        return feats
+            feats = self.sinc.extract()
+            return feats.reshape((feats.size, 1))
 
 
-class NavHistory(object):
-    """ Navigation history features.
+class CmdHistory(History):
+    """ Command history features.
     """
-    def __init__(self, num_feats, max_length):
-        self.num_feats = num_feats
-        self.max_length = max_length
-        self.history = np.zeros((4, max_length))
+    def update(self, cmd, form=False):
+        """ Updates the history with the specified command.
 
-        # Create the spacing for the exponentially decreasing time periods.
-        self.spacing = get_spacing(self.max_length, self.num_feats, func='log')
+            Argument form specifies specifies whether the command has been
+            transformed into a col vector or whether it is the same form as that
+            which is sent to the drone.
+        """
+        cmd_vec = cmd if form else (cmd['X'], cmd['Y'], cmd['Z'], cmd['R'])
+        self.push(cmd_vec)
 
+
+class NavHistory(History):
+    """ Navigation history features.
+    """
     def update(self, navdata, form=False):
         """ Updates the navigation data history with the current navigation
             data.
-        """
-        # Parse the navigation data getting only the useful info and form it
-        # into an array.
-        useful_nav_data = []
-        if not form:
-            useful_nav_data.append(navdata['demo']['altitude'])
-            useful_nav_data.append(navdata['demo']['rotation']['pitch'])
-            useful_nav_data.append(navdata['demo']['rotation']['roll'])
-            useful_nav_data.append(navdata['demo']['rotation']['yaw'])
-        
-        useful_nav_data = np.array(useful_nav_data)
-        self.history = np.roll(self.history, 1)
-        self.history[:, 0] = useful_nav_data
-
-    def extract(self, low_pass_filter='average'):
-        """ Extracts the navigation history features.
 
-            Filter can be 'average' or 'sinc'.
+            The navigation data may also be an array of the receiver's
+            NAV_FIELDS, as decoded from a record, which is used as it is.
         """
-        if low_pass_filter == 'average':
-            func = low_pass_average
-        elif low_pass_filter == 'sinc':
-            func = low_pass_sinc_window
-        feats = func(self.history, self.spacing)
-        return feats
+        # Parse the navigation data getting only the useful info.
+        if form or isinstance(navdata, np.ndarray):
+            useful_nav_data = navdata
+        else:
+            useful_nav_data = (navdata['demo']['altitude'],
+                               navdata['demo']['rotation']['pitch'],
+                               navdata['demo']['rotation']['roll'],
+                               navdata['demo']['rotation']['yaw'])
+        self.push(useful_nav_data)
 
 
 def _test_command_history():
@@ -169,8 +266,45 @@ def _test_command_history():
         print(sys.exc_info())
 
 
+def _test_navigation_history():
+    pdb.set_trace()
+    num_feats = 7
+    max_length = 35
+    nav_history = NavHistory(num_feats, max_length)
+    for i in range(0, 2*max_length):
+        nav_history.update(np.array([i, 0, 0, 0]), form=True)
+
+    # Compare the running averages with averages of the whole history.
+    nav_history_feats = nav_history.extract()
+    history = nav_history.get_history()
+    for (i, period) in enumerate(nav_history.periods):
+        assert np.allclose(nav_history_feats[4*i:4*i + 4, 0], np.mean(history[:, 0:period], 1))
+    print(nav_history_feats)
+
+
+def _test_sinc_history():
+    num_feats = 7
+    max_length = 10
+    nav_history = NavHistory(num_feats, max_length)
+
+    # Compare the streaming sinc filters with the reference filters of the
+    # whole history, for a step and then a noisy signal.
+    signal = np.hstack((np.ones(max_length), np.random.randn(3*max_length)))
+    for (t, value) in enumerate(signal):
+        nav_history.update(np.array([value, 2*value, 0, 1]), form=True)
+        stream = nav_history.extract(low_pass_filter='sinc')
+        reference = low_pass_sinc_window(nav_history.get_history(), nav_history.periods)
+        assert np.allclose(stream, reference)
+
+        # The filters pass a step through once it fills the history.
+        if t == max_length - 1:
+            assert np.allclose(stream.reshape((-1, 4))[:, 0], 1.0)
+    print(nav_history.extract(low_pass_filter='sinc'))
+
+
 if __name__ == '__main__':
     import pdb
     import sys
     #_test_command_history()
     _test_navigation_history()
+    _test_sinc_history()
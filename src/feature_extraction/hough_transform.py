@@ -6,6 +6,8 @@
 import numpy as np
 import cv2
 
+from frame import as_frame
+
 
 class HoughTransform(object):
     """ Extracts Hough transform features.
@@ -18,6 +20,13 @@ class HoughTransform(object):
         self.theta = np.pi/180.0    # angle resolution of the accumulator in radians
         self.hough_thresh = 100     # accumulator threshold parameter in number of votes
 
+        # Line length and gap used for single windows. Lines of 100 pixels
+        # hardly fit in a window, and the window features were always found
+        # with these values (max_line_gap used to be passed where the minimum
+        # line length goes and the maximum gap was left at 0), so they are kept.
+        self.window_min_line_length = 5
+        self.window_max_line_gap = 0
+
         # The maximum angled allowed for a line to be valid when the line is
         # intersected with a vertical line. Setting this parameter to pi allows
         # all lines to be valid while setting it to 0 (+ delta) allows only
@@ -29,14 +38,83 @@ class HoughTransform(object):
         self.can_thresh2 = 100
         self.aperature_size = 3
 
+        # The minimum fraction of edge pixels a window needs to have its lines
+        # assigned to it when extracting the lines of the whole frame.
+        self.min_edge_density = 0.01
+
     def extract(self, img):
-        """ Applies the Hough transform to the image to find lines in it.
+        """ Applies the Hough transform to the window (or Frame) to find lines
+            in it.
         """
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        gray = as_frame(img).get_gray()
         edges = cv2.Canny(gray, self.can_thresh1, self.can_thresh2, apertureSize=self.aperature_size)
-        lines = cv2.HoughLinesP(edges, self.rho, self.theta, self.hough_thresh, self.min_line_length, self.max_line_gap)
+        lines = cv2.HoughLinesP(edges, self.rho, self.theta, self.hough_thresh,
+                                minLineLength=self.window_min_line_length, maxLineGap=self.window_max_line_gap)
         return lines
 
+    def extract_windows(self, img, bounds):
+        """ Finds the edges and lines of the whole image once and assigns the
+            lines to many windows of the image at once.
+
+            Argument bounds is an array with a (x_start, x_end, y_start, y_end)
+            row per window. Every line is clipped to every window and the
+            longest clipped line of each window is its feature, in the
+            coordinates of the window. Windows with an edge density under
+            min_edge_density are skipped and get zeros. Returns an array with a
+            row of features per window.
+        """
+        gray = as_frame(img).get_gray()
+        edges = cv2.Canny(gray, self.can_thresh1, self.can_thresh2, apertureSize=self.aperature_size)
+        features = np.zeros((bounds.shape[0], 4))
+
+        # Get the edge density of every window from an integral image.
+        (x_start, x_end, y_start, y_end) = [b[:, None] for b in np.transpose(bounds)]
+        area = (x_end - x_start)*(y_end - y_start)
+        edge_sum = cv2.integral(edges, sdepth=cv2.CV_64F)/255.0
+        density = (edge_sum[y_end, x_end] - edge_sum[y_start, x_end] -
+                   edge_sum[y_end, x_start] + edge_sum[y_start, x_start])/area
+        dense = density[:, 0] >= self.min_edge_density
+        if not np.any(dense):
+            return features
+
+        lines = cv2.HoughLinesP(edges, self.rho, self.theta, self.hough_thresh,
+                                minLineLength=self.min_line_length, maxLineGap=self.max_line_gap)
+        if lines is None:
+            return features
+        lines = lines.reshape((-1, 4)).astype(np.float64)
+
+        # Clip every line to every window (Liang-Barsky), giving arrays with a
+        # row per window and a column per line.
+        (x1, y1, x2, y2) = [l[None, :] for l in np.transpose(lines)]
+        (dx, dy) = (x2 - x1, y2 - y1)
+        t_enter = np.zeros((bounds.shape[0], lines.shape[0]))
+        t_exit = np.ones((bounds.shape[0], lines.shape[0]))
+        valid = np.ones((bounds.shape[0], lines.shape[0]), dtype=bool)
+        for (p, q) in [(-dx, x1 - x_start), (dx, x_end - x1), (-dy, y1 - y_start), (dy, y_end - y1)]:
+            p = np.broadcast_to(p, t_enter.shape)
+            q = np.broadcast_to(q, t_enter.shape)
+            parallel = p == 0
+            valid &= ~(parallel & (q < 0))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = q/p
+            t_enter = np.where(~parallel & (p < 0), np.maximum(t_enter, t), t_enter)
+            t_exit = np.where(~parallel & (p > 0), np.minimum(t_exit, t), t_exit)
+        valid &= (t_enter < t_exit) & dense[:, None]
+
+        # Keep the longest clipped line of each window.
+        length = np.where(valid, (t_exit - t_enter)*np.hypot(dx, dy), -1)
+        best = np.argmax(length, axis=1)
+        rows = np.arange(bounds.shape[0])
+        found = length[rows, best] > 0
+        (t0, t1) = (t_enter[rows, best], t_exit[rows, best])
+        (x1, y1, dx, dy) = [a[0, best] for a in (x1, y1, dx, dy)]
+        features[:, 0] = x1 + t0*dx - x_start[:, 0]
+        features[:, 1] = y1 + t0*dy - y_start[:, 0]
+        features[:, 2] = x1 + t1*dx - x_start[:, 0]
+        features[:, 3] = y1 + t1*dy - y_start[:, 0]
+        features[~found] = 0
+        return features
+
     @staticmethod
     def get_image(img, lines):
         """ Draws the lines found by Hough transform extractor on the image.
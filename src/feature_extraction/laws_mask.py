@@ -6,65 +6,74 @@
 import numpy as np
 import cv2
 
+from frame import as_frame
+
 
 class LawsMask(object):
     """ Law's Mask features.
+
+        Each mask is the outer product of two of the L (level), E (edge) and S
+        (spot) vectors, so it is applied as a separable filter. The features
+        are the mean absolute response (texture energy) of the LL mask on the
+        Y, Cr and Cb channels and of the LE, LS, EE, ES and SS masks on the Y
+        channel.
     """
     def __init__(self):
         # Create the initial laws mask vectors.
-        L3 = np.transpose(np.array([1, 2, 1]))
-        E3 = np.transpose(np.array([-1, 0, 1]))
-        S3 = np.transpose(np.array([-1, 2, -1]))
-
-        L5 = np.transpose(np.array([1, 4, 6, 4, 1]))
-        E5 = np.transpose(np.array([-1, -2, 0, 1]))
-        S5 = np.transpose(np.array([-1, 0, 2, 0, 1]))
-
-        self.LL3 = np.convolve(L3, np.transpose(L3))
-        self.LE3 = np.convolve(L3, np.transpose(E3))
-        self.LS3 = np.convolve(L3, np.transpose(S3))
-        self.EE3 = np.convolve(E3, np.transpose(E3))
-        self.ES3 = np.convolve(E3, np.transpose(S3))
-        self.SS3 = np.convolve(S3, np.transpose(S3))
-
-        self.LL5 = np.convolve(L5, np.transpose(L5))
-        self.LE5 = np.convolve(L5, np.transpose(E5))
-        self.LS5 = np.convolve(L5, np.transpose(S5))
-        self.EE5 = np.convolve(E5, np.transpose(E5))
-        self.ES5 = np.convolve(E5, np.transpose(S5))
-        self.SS5 = np.convolve(S5, np.transpose(S5))
+        L3 = np.array([1, 2, 1], dtype=np.float32)
+        E3 = np.array([-1, 0, 1], dtype=np.float32)
+        S3 = np.array([-1, 2, -1], dtype=np.float32)
+
+        L5 = np.array([1, 4, 6, 4, 1], dtype=np.float32)
+        E5 = np.array([-1, -2, 0, 2, 1], dtype=np.float32)
+        S5 = np.array([-1, 0, 2, 0, -1], dtype=np.float32)
+
+        # The (channel, vertical vector, horizontal vector) of each feature.
+        (Y, Cr, Cb) = (0, 1, 2)
+        self.masks = {
+            3: [(Y, L3, L3), (Cr, L3, L3), (Cb, L3, L3), (Y, L3, E3), (Y, L3, S3), (Y, E3, E3), (Y, E3, S3), (Y, S3, S3)],
+            5: [(Y, L5, L5), (Cr, L5, L5), (Cb, L5, L5), (Y, L5, E5), (Y, L5, S5), (Y, E5, E5), (Y, E5, S5), (Y, S5, S5)]
+        }
 
     def extract(self, image, filter_size=5, convert=False):
         """ Extract Law's texture masks from the image. Make sure the image is
-            in the YCrCb color space before calling this function.
+            in the YCrCb color space before calling this function or set
+            convert to convert it (or a Frame) from BGR.
+        """
+        if convert:
+            image = as_frame(image).get_ycrcb()
+
+        # Apply the filters.
+        planes = cv2.split(image)
+        features = np.zeros((len(self.masks[filter_size]), 1))
+        for (i, (channel, ky, kx)) in enumerate(self.masks[filter_size]):
+            response = cv2.sepFilter2D(planes[channel], cv2.CV_32F, kx, ky)
+            features[i] = np.mean(np.abs(response))
+        return features
+
+    def extract_windows(self, image, bounds, filter_size=5, convert=False):
+        """ Extract Law's texture masks for many windows of the image at once.
+
+            Each channel is filtered once over the whole image and the energy of
+            each filter is summed into an integral image, so the mean energy of
+            any window is read from four corners of it. Argument bounds is an
+            array with a (x_start, x_end, y_start, y_end) row per window, within
+            the image. Returns an array with a row of features per window.
         """
         if convert:
-            image = cv2.cvtColor(cv2.imgCV_RGB2YCrCb)
-
-        # Apply the filter.
-        (Y, Cr, Cb) = cv2.split(image)
-        if filter_size == 3:
-            Y_LL  = abs(np.mean(cv2.filter2D(Y, -1, self.LL3)))
-            Cr_LL = abs(np.mean(cv2.filter2D(Y, -1, self.LL3)))
-            Cb_LL = abs(np.mean(cv2.filter2D(Y, -1, self.LL3)))
-            Y_LE  = abs(np.mean(cv2.filter2D(Y, -1, self.LE3)))
-            Y_LS  = abs(np.mean(cv2.filter2D(Y, -1, self.LS3)))
-            Y_EE  = abs(np.mean(cv2.filter2D(Y, -1, self.EE3)))
-            Y_ES  = abs(np.mean(cv2.filter2D(Y, -1, self.ES3)))
-            Y_SS  = abs(np.mean(cv2.filter2D(Y, -1, self.SS3)))
-        elif filter_size == 5:
-            Y_LL  = abs(np.mean(cv2.filter2D(Y, -1, self.LL3)))
-            Cr_LL = abs(np.mean(cv2.filter2D(Y, -1, self.LL3)))
-            Cb_LL = abs(np.mean(cv2.filter2D(Y, -1, self.LL3)))
-            Y_LE  = abs(np.mean(cv2.filter2D(Y, -1, self.LE3)))
-            Y_LS  = abs(np.mean(cv2.filter2D(Y, -1, self.LS3)))
-            Y_EE  = abs(np.mean(cv2.filter2D(Y, -1, self.EE3)))
-            Y_ES  = abs(np.mean(cv2.filter2D(Y, -1, self.ES3)))
-            Y_SS  = abs(np.mean(cv2.filter2D(Y, -1, self.SS3)))
-
-        # Construct the feature vector.
-        features = np.array([Y_LL, Cr_LL, Cb_LL, Y_LE, Y_LS, Y_EE, Y_ES, Y_SS])
-        features.shape = (features.shape[0], 1)
+            image = as_frame(image).get_ycrcb()
+
+        (x_start, x_end, y_start, y_end) = np.transpose(bounds)
+        area = (x_end - x_start)*(y_end - y_start)
+
+        # Apply the filters.
+        planes = cv2.split(image)
+        features = np.zeros((bounds.shape[0], len(self.masks[filter_size])))
+        for (i, (channel, ky, kx)) in enumerate(self.masks[filter_size]):
+            response = cv2.sepFilter2D(planes[channel], cv2.CV_32F, kx, ky)
+            energy = cv2.integral(np.abs(response), sdepth=cv2.CV_64F)
+            features[:, i] = (energy[y_end, x_end] - energy[y_start, x_end] -
+                              energy[y_end, x_start] + energy[y_start, x_start])/area
         return features
 
 
@@ -72,7 +81,7 @@ def _test_laws_mask():
     sample_img_filenames = ['../../samples/test_forest.jpg']
     sample_img = cv2.imread(sample_img_filenames[0])
     laws_mask = LawsMask()
-    features = laws_mask.extract(sample_img)
+    features = laws_mask.extract(sample_img, convert=True)
     print(features)
 
 if __name__ == '__main__':
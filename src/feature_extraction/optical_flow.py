@@ -6,6 +6,8 @@
 import numpy as np
 import cv2
 
+from frame import as_frame
+
 
 class OpticalFlow(object):
     """ Extracts dense optical flow features from an image and its predecessor
@@ -22,11 +24,14 @@ class OpticalFlow(object):
         Source: [M. Werlberger, T. Pock, and H. Bischof. Motion estimation with
         non-local total variation regularization. In CVPR, 2010.]
     """
-    def __init__(self, init_frame):
-        # Parameters of the camera/images.
-        (r, c, _) = init_frame.shape
+    def __init__(self, init_frame, scale=1.0):
+        # Parameters of the camera/images. Frames are resized by scale before
+        # the flow is computed, so scale < 1 trades resolution for speed.
+        self.scale = scale
+        init_frame = as_frame(init_frame).get_scaled(self.scale)
+        (r, c, _) = init_frame.image.shape
         self.shape = (r, c)
-        self.prev_gray = cv2.cvtColor(init_frame, cv2.COLOR_BGR2GRAY)
+        self.prev_gray = init_frame.get_gray()
 
         # Parameters for farneback optical flow.
         self.pyr_scale = 0.5   # next layer is twice smaller than the previous
@@ -38,11 +43,11 @@ class OpticalFlow(object):
         self.flags = 0         # no flags (OPTFLOW_USE_INITIAL_FLOW, OPTFLOW_FARNEBACK_GAUSSIAN)
 
     def extract(self, frame):
-        """ Extract optical flow from the current frame containing the
-            cartesian flow vectors for each pixel.
+        """ Extract optical flow from the current frame (an image or a Frame)
+            containing the cartesian flow vectors for each pixel.
         """
         # Get the cv flow using farneback
-        cur_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        cur_gray = as_frame(frame).get_scaled(self.scale).get_gray()
         flow = cv2.calcOpticalFlowFarneback(self.prev_gray,
                                             cur_gray,
                                             pyr_scale=self.pyr_scale,
@@ -106,6 +111,73 @@ class OpticalFlow(object):
         features[indices['STDY']] = np.std(flow_y)
         return features
 
+    @staticmethod
+    def get_window_features(flow, windows, scale=1.0):
+        """ Pools the features of get_features for every window at once from
+            a flow matrix computed over the whole frame.
+
+            Argument windows is the grid returned by get_windows for the full
+            size frame and scale is the scale the flow was computed at. The
+            windows of the grid share their row and column bounds, so the
+            minimum, maximum and sums over each window are found by reducing
+            over the row bounds and then over the column bounds. Returns an
+            array with shape (rows*cols*5, 1) ordered window by window, the
+            same as stacking get_features for each window. The flow of a
+            downscaled frame is in downscaled pixels, so the features are
+            divided by scale to give them in pixels of the full size frame.
+        """
+        (r, c, _) = flow.shape
+        y_bounds = [windows[i][0][2:4] for i in range(0, len(windows))]
+        x_bounds = [windows[0][j][0:2] for j in range(0, len(windows[0]))]
+        y_idx = _get_reduce_indices(y_bounds, scale, r)
+        x_idx = _get_reduce_indices(x_bounds, scale, c)
+        area = np.outer(y_idx[1::2] - y_idx[0::2], x_idx[1::2] - x_idx[0::2])
+
+        # Convert the flow to polar and pad it with a row and column so that
+        # windows on the border have a valid upper reduction index.
+        flow_x = flow[..., 0]
+        flow_y = flow[..., 1]
+        (flow_mag, _) = cv2.cartToPolar(flow_x, flow_y)
+        planes = np.zeros((5, r + 1, c + 1))
+        planes[0, :r, :c] = flow_mag
+        planes[1, :r, :c] = flow_x
+        planes[2, :r, :c] = flow_y
+        planes[3, :r, :c] = flow_x*flow_x
+        planes[4, :r, :c] = flow_y*flow_y
+
+        def pool(ufunc, a):
+            a = ufunc.reduceat(a, y_idx, axis=-2)[..., ::2, :]
+            return ufunc.reduceat(a, x_idx, axis=-1)[..., ::2]
+
+        mag = planes[0]
+        sums = pool(np.add, planes)
+        mean_x = sums[1]/area
+        mean_y = sums[2]/area
+
+        # Calculate the features.
+        features = np.zeros((len(y_bounds), len(x_bounds), 5))
+        features[..., 0] = pool(np.minimum, mag)
+        features[..., 1] = pool(np.maximum, mag)
+        features[..., 2] = sums[0]/area
+        features[..., 3] = np.sqrt(np.maximum(sums[3]/area - mean_x*mean_x, 0))
+        features[..., 4] = np.sqrt(np.maximum(sums[4]/area - mean_y*mean_y, 0))
+        features /= scale
+        features.shape = (features.size, 1)
+        return features
+
+
+def _get_reduce_indices(bounds, scale, length):
+    """ Scales the (start, end) bounds of the windows along one axis and
+        interleaves them into indices for a ufunc reduceat.
+    """
+    idx = np.zeros(2*len(bounds), dtype=np.intp)
+    for (i, (start, end)) in enumerate(bounds):
+        start = min(int(round(start*scale)), length - 1)
+        end = min(max(int(round(end*scale)), start + 1), length)
+        idx[2*i] = start
+        idx[2*i + 1] = end
+    return idx
+
 
 def _test_optical_flow():
     pdb.set_trace()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python2.7
+
+""" Extracts the Hough transform and Law's mask features of the windows of an
+    image across several processes.
+"""
+
+import ctypes
+import multiprocessing
+from multiprocessing import sharedctypes
+import numpy as np
+import cv2
+
+# Feature modules.
+import feature_layout
+import hough_transform
+import laws_mask
+
+
+# Number of Hough transform and Law's mask features of each window.
+HOUGH_FEATS = len(feature_layout.HOUGH_FEATS)
+LAWS_FEATS = len(feature_layout.LAWS_FEATS)
+
+# Largest frame in bytes the pool takes (a 1280x720 BGR image).
+MAX_FRAME_SIZE = 1280*720*3
+
+# State of each worker process, set up by _init_worker.
+_worker = {}
+
+
+class WindowPool(object):
+    """ Pool of processes which shards the windows of each frame.
+
+        The frame is copied once into shared memory which the workers map as a
+        numpy array, and each worker writes the features of its windows into a
+        shared feature matrix, so no arrays are pickled between processes.
+        Argument extractors lists which of 'hough' and 'laws' the workers
+        extract.
+
+        The processes are forked, so the pool must be created before any
+        thread is started. It is therefore created without knowing the frames
+        it will be given: frames of up to max_frame_size bytes are taken, and
+        their shape and windows are sent along with each one.
+    """
+    def __init__(self, num_windows, processes, extractors=('hough', 'laws'), max_frame_size=MAX_FRAME_SIZE):
+        self.num_windows = num_windows
+        self.processes = processes
+        num_feats = HOUGH_FEATS + LAWS_FEATS
+
+        # Shared memory for the frame and the features of every window.
+        frame_buf = sharedctypes.RawArray(ctypes.c_uint8, max_frame_size)
+        feats_buf = sharedctypes.RawArray(ctypes.c_double, num_windows*num_feats)
+        self.frame = np.frombuffer(frame_buf, dtype=np.uint8)
+        self.feats = np.frombuffer(feats_buf, dtype=np.float64).reshape((num_windows, num_feats))
+
+        self.pool = multiprocessing.Pool(processes,
+                                         _init_worker,
+                                         (frame_buf, feats_buf, self.feats.shape, extractors))
+
+    def extract_async(self, image, windows, window_shape):
+        """ Starts extracting the features of the windows of the image, each
+            resized to window_shape. Call wait on the result before reading the
+            features.
+        """
+        if image.dtype != np.uint8 or image.size > self.frame.size:
+            raise ValueError('frame of shape %s does not fit in the pool' % (image.shape,))
+        bounds = [w for row in windows for w in row]
+        if len(bounds) != self.num_windows:
+            raise ValueError('%s windows given to a pool of %s windows' % (len(bounds), self.num_windows))
+        self.frame[:image.size] = image.ravel()
+
+        # Deal the windows out to the processes in row major order.
+        indexed = list(enumerate(bounds))
+        shards = [(image.shape, window_shape, indexed[i::self.processes]) for i in range(0, self.processes)]
+        return self.pool.map_async(_extract_windows, shards)
+
+    def get_hough_features(self):
+        """ Gets a view of the Hough transform features with a row per window.
+        """
+        return self.feats[:, 0:HOUGH_FEATS]
+
+    def get_laws_features(self):
+        """ Gets a view of the Law's mask features with a row per window.
+        """
+        return self.feats[:, HOUGH_FEATS:]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+def _init_worker(frame_buf, feats_buf, feats_shape, extractors):
+    _worker['frame'] = np.frombuffer(frame_buf, dtype=np.uint8)
+    _worker['feats'] = np.frombuffer(feats_buf, dtype=np.float64).reshape(feats_shape)
+    _worker['extractors'] = extractors
+    _worker['hough'] = hough_transform.HoughTransform()
+    _worker['laws'] = laws_mask.LawsMask()
+
+
+def _extract_windows(shard):
+    (shape, window_shape, windows) = shard
+    frame = _worker['frame'][:int(np.prod(shape))].reshape(shape)
+    feats = _worker['feats']
+    for (i, (x_start, x_end, y_start, y_end)) in windows:
+        # Resize the window the same way the serial extractor does.
+        cur_window = frame[y_start:y_end, x_start:x_end]
+        cur_window = cv2.resize(cur_window, window_shape[::-1])
+
+        if 'hough' in _worker['extractors']:
+            lines = _worker['hough'].extract(cur_window)
+            feats[i, 0:HOUGH_FEATS] = hough_transform.HoughTransform.get_features(lines)[:, 0]
+        if 'laws' in _worker['extractors']:
+            feats[i, HOUGH_FEATS:] = _worker['laws'].extract(cur_window, convert=True)[:, 0]
+    return len(windows)
@@ -21,8 +21,12 @@ from PIL import ImageTk, Image
 # Igor's modules.
 import args
 import debug
+import frame_pack
+import latency
 import parrot
+import recorder
 import remote
+import scheduler
 import tracking
 from tools import annotate
 from feature_extraction import feature_extractor
@@ -40,18 +44,28 @@ class FlyTool(object):
         self.gui = args.gui
         self.verbosity = args.verbosity
 
-        self.debug_queue = Queue.Queue()
+        # The window feature processes are forked, so they are started before
+        # any of the tool's threads (the debugger's writer included).
+        if args.command == 'exec':
+            self.init_feature_params(args)
+
+        # Debug messages are printed by the debugger's writer thread, so
+        # printing doesn't hold up the control loop.
+        self.debug_queue = debug.LogQueue(self.verbosity)
         self.error_queue = Queue.Queue()
-        self.debugger = debug.Debug(self.verbosity, self.debug_queue, self.error_queue)
+        self.debugger = debug.Debug(self.verbosity, self.debug_queue, self.error_queue, threaded=True)
 
-        if args.command == 'train':
-            self.train(args)
-        elif args.command == 'test':
-            self.test(args)
-        elif args.command == 'exec':
-            self.execute(args)
-        elif args.command == 'annotate':
-            self.annotate(args)
+        try:
+            if args.command == 'train':
+                self.train(args)
+            elif args.command == 'test':
+                self.test(args)
+            elif args.command == 'exec':
+                self.execute(args)
+            elif args.command == 'annotate':
+                self.annotate(args)
+        finally:
+            self.debugger.close(timeout=1.0)
 
     def train(self, args):
         """ Starts training. Make sure you have annotated the images first.
@@ -64,32 +78,52 @@ class FlyTool(object):
         self.dag.aggregate(self.iterations)
 
 
+    def init_feature_params(self, args):
+        """ Sets the feature extraction parameters and creates the process pool
+            of the window features, if any.
+        """
+        self.window_size = (10, 5)
+        self.overlap = 0.25
+        self.cmd_history_feats = 7    # the approximate number of cmd history features
+        self.cmd_history_length = 10  # keep a running list of the last 10 cmds
+        self.nav_history_feats = 7    # the approximate number of nav history features
+        self.nav_history_length = 10  # keep a running list of the last 10 nav data
+        self.flow_mode = 'window'     # 'frame' computes the flow once per frame and pools it
+        self.flow_scale = 0.5         # the scale of the frame used when flow_mode is 'frame'
+        self.laws_mode = 'window'     # 'frame' filters the frame once and reads each window from integral images
+        self.hough_mode = 'window'    # 'frame' finds the lines of the frame once and assigns them to windows
+        self.window_pool = feature_extractor.create_window_pool(self.window_size,
+                                                                args.processes,
+                                                                hough_mode=self.hough_mode,
+                                                                laws_mode=self.laws_mode)
+
     def execute(self, args):
         # Get the arguments for this subcommand.
         self.address = args.address
         self.learning = args.learning
         self.iteration = args.iteration
         self.trajectory = args.trajectory
+        self.decode = args.decode
+        self.video = args.video
+        self.control_rate = args.control_rate
+        self.record_policy = args.record_policy
+        self.frame_format = args.frame_format
+        self.latency_interval = args.latency
 
         # Create the dagger object and train it.
         pdb.set_trace()
         self.dag = dagger.DAgger(self.learning)
         self.dag.train()
 
-        # Feature extraction parameters.
-        window_size = (10, 5)
-        overlap = 0.25
-        cmd_history_feats = 7    # the approximate number of cmd history features
-        cmd_history_length = 10  # keep a running list of the last 10 cmds
-        nav_history_feats = 7    # the approximate number of nav history features
-        nav_history_length = 10  # keep a running list of the last 10 nav data
-
         self.debug_queue.put({'MSG': 'Parrot AR 2 Flying Tool :: Execution Mode', 'PRIORITY': 1})
         self.debug_queue.put({'MSG': ':: GUI flag set to %s.' % str(self.gui), 'PRIORITY': 1})
         self.debug_queue.put({'MSG': ':: Verbosity set to %d.' % self.verbosity, 'PRIORITY': 1})
         self.debug_queue.put({'MSG': ':: Accessing controller server at: %s.' % self.address[0], 'PRIORITY': 1})
         self.debug_queue.put({'MSG': ':: Accessing navigation data server at: %s.' % self.address[1], 'PRIORITY': 1})
-        self.debug_queue.put({'MSG': ':: Accessing camera stream server at: tcp://192.168.1.1:5555.', 'PRIORITY': 1})
+        if self.video is None:
+            self.debug_queue.put({'MSG': ':: Accessing camera stream server at: tcp://192.168.1.1:5555.', 'PRIORITY': 1})
+        else:
+            self.debug_queue.put({'MSG': ':: Replaying camera stream from: %s.' % self.video, 'PRIORITY': 1})
 
         # Create the drone object.
         self.debug_queue.put({'MSG': ':: Initializing parrot.', 'PRIORITY': 1})
@@ -99,18 +133,35 @@ class FlyTool(object):
                                    self.address,
                                    self.learning,
                                    self.iteration,
-                                   self.trajectory)
+                                   self.trajectory,
+                                   self.decode,
+                                   self.video,
+                                   args.replay_mode,
+                                   args.replay_rate)
 
         self.feature_queue = Queue.Queue(maxsize=1)
-        init_image = self.drone.get_image()
+        try:
+            init_image = self.drone.get_image()
+        except parrot.EndOfStream:
+            self.debug_queue.put({'MSG': 'The camera stream ended before its first frame. Exiting...', 'PRIORITY': 1})
+            self.debugger.debug()
+            if self.window_pool is not None:
+                self.window_pool.close()
+            return
         self.feature_extractor = feature_extractor.FeatureExtractor(self.feature_queue,
                                                                     init_image,
-                                                                    window_size,
-                                                                    overlap,
-                                                                    cmd_history_feats,
-                                                                    cmd_history_length,
-                                                                    nav_history_feats,
-                                                                    nav_history_length)
+                                                                    self.window_size,
+                                                                    self.overlap,
+                                                                    self.cmd_history_feats,
+                                                                    self.cmd_history_length,
+                                                                    self.nav_history_feats,
+                                                                    self.nav_history_length,
+                                                                    flow_mode=self.flow_mode,
+                                                                    flow_scale=self.flow_scale,
+                                                                    laws_mode=self.laws_mode,
+                                                                    hough_mode=self.hough_mode,
+                                                                    error_queue=self.error_queue,
+                                                                    window_pool=self.window_pool)
 
         directory = './data/%s/%s/' % (self.iteration, self.trajectory)
 
@@ -121,92 +172,132 @@ class FlyTool(object):
         self.debug_queue.put({'MSG': 'Waiting to take off...', 'PRIORITY': 1})
         self.debugger.debug()
 
-        # Start when the drone takes off.
+        # Start when the drone takes off, polling the remote at the control
+        # rate instead of spinning.
+        takeoff_scheduler = scheduler.RateScheduler(self.control_rate)
         while True:
+            takeoff_scheduler.wait()
             cmd = self.drone.get_cmd()
-            self.drone.send_cmd(cmd)
-
             if cmd is not None:
+                self.drone.send_cmd(cmd)
                 if cmd['T']:
                     break
         self.debug_queue.put({'MSG': 'Starting training for iteration %s, trajectory %s.', 'PRIORITY': 1})
         self.debugger.debug()
 
-        features_filename = directory + 'features.data'
-        cmd_filename = directory + 'drone_cmds.data'
+        # Record the time steps in the background.
+        feature_columns = self.feature_extractor.layout.get_column_names()
+        self.recorder = recorder.Recorder(self.debug_queue, self.error_queue, directory, feature_columns, frame_format=self.frame_format, policy=self.record_policy)
+        self.recorder.start()
 
-        # Loop until the drone has landed.
+        # Loop until the drone has landed, once per tick of the control rate.
         self.time_step = 1
         feature_flag = False
-        while True:
-            # Land to avoid a crash.
-            emergency_cmd = self.drone.get_cmd()
-            if emergency_cmd is not None:
-                if emergency_cmd['L']:
-                    self.drone.send_cmd(self.drone.remote.land())
-                    break
+        self.scheduler = scheduler.RateScheduler(self.control_rate)
+
+        # The latencies of the frames from capture to command.
+        self.latency = latency.LatencyStats()
+        last_report = time.time()
+        trace = None
+
+        # Write what has been recorded when the drone lands, the camera's
+        # stream ends or the loop fails.
+        try:
+            while True:
+                self.scheduler.wait()
+                if self.latency_interval and time.time() - last_report >= self.latency_interval:
+                    self.debug_queue.put({'MSG': ':: Latencies in ms:\n%s', 'ARGS': (self.latency,), 'PRIORITY': 1})
+                    last_report = time.time()
+                self.debugger.debug()
+
+                # Land to avoid a crash.
+                emergency_cmd = self.drone.get_cmd()
+                if emergency_cmd is not None:
+                    if emergency_cmd['L']:
+                        self.drone.send_cmd(self.drone.remote.land())
+                        break
+
+                expert_cmd = self.drone.get_cmd()
+                expert_cmd['X'] = expert_cmd['X']*0.15
+                if self.iteration == 1:
+                    expert_cmd['Y'] = 0.02
+                    if expert_cmd is not None and not feature_flag:
+                        snapshot = self.drone.snapshot(get_cmd=False)
+                        (frame, navdata) = (snapshot.frame, snapshot.navdata)
+                        image = frame.image
+                        self.feature_extractor.extract(frame)
+                        self.feature_extractor.update(cmd, navdata)
+                        feature_flag = True
+                    try:
+                        (_, features) = self.feature_queue.get(block=False)
+                        trace = frame.trace
+                        # Save the features and command.
+                        self.recorder.record(self.time_step, image, features, expert_cmd)
+                        self.time_step += 1
+                        feature_flag = False
+                    except Queue.Empty:
+                        pass
+                    self.drone.send_cmd(expert_cmd, trace)
+                    if trace is not None:
+                        self.latency.record_trace(trace)
+                        trace = None
+                else:
+                    if not feature_flag:
+                        snapshot = self.drone.snapshot(get_cmd=False)
+                        (frame, navdata) = (snapshot.frame, snapshot.navdata)
+                        image = frame.image
+                        self.feature_extractor.extract(frame)
+                        feature_flag = True
+                    try:
+                        (_, features) = self.feature_queue.get(block=False)
+
+                        # Get the command associated with this state. The
+                        # learner is trained on the time step column too.
+                        blah = np.array([0])
+                        blah.shape = (1, 1)
+                        with latency.timed(frame.trace, 'policy'):
+                            x = self.dag.test(np.hstack((blah, features)), self.iteration)
+                        cmd = self.drone.default_cmd
+                        cmd['Y'] = 0.02
+                        cmd['X'] = x[0,0]*0.15
+                        self.debugger.log(1, 'Policy output: %s.', x)
+                        self.feature_extractor.update(cmd, navdata)
+
+                        # Save the features and command.
+                        self.recorder.record(self.time_step, image, features, cmd)
+                        self.time_step += 1
+
+                        self.drone.send_cmd(cmd, frame.trace)
+                        if frame.trace is not None:
+                            self.latency.record_trace(frame.trace)
+                        feature_flag = False
+                    except Queue.Empty:
+                        pass
+        except parrot.EndOfStream:
+            self.land_at_end()
+        finally:
+            self.recorder.close()
+            self.debug_queue.put({'MSG': ':: Latencies in ms:\n%s', 'ARGS': (self.latency,), 'PRIORITY': 1})
+            self.debugger.debug()
+
+        self.feature_extractor.stop()
+        stats = self.scheduler.get_stats()
+        self.debug_queue.put({'MSG': ':: Control loop ran %d ticks and missed %d, with a mean jitter of %.1f ms and a largest of %.1f ms.', 'ARGS': (stats['TICKS'], stats['MISSED'], 1000*stats['JITTER_MEAN'], 1000*stats['JITTER_MAX']), 'PRIORITY': 1})
+        self.debugger.debug()
+
+    def land_at_end(self):
+        """ Lands the drone once the camera's stream has ended (e.g. a replay
+            has played to the end).
+        """
+        self.debug_queue.put({'MSG': 'The camera stream has ended, landing.', 'PRIORITY': 1})
+        self.drone.send_cmd(self.drone.remote.land())
 
-            image_filename = directory + '%s.jpg' % self.time_step
-
-            expert_cmd = self.drone.get_cmd()
-            expert_cmd['X'] = expert_cmd['X']*0.15
-            if self.iteration == 1:
-                expert_cmd['Y'] = 0.02
-                if expert_cmd is not None and not feature_flag:
-                    image = self.drone.get_image()
-                    navdata = self.drone.get_navdata()
-                    self.feature_extractor.extract(image)
-                    self.feature_extractor.update(cmd, navdata)
-                    feature_flag = True
-                try:
-                    features = self.feature_queue.get(block=False)
-                    # Save the features and command.
-                    self.save_image(image, image_filename)
-                    self.save_features(features, features_filename)
-                    self.save_cmd(expert_cmd, cmd_filename)
-                    self.time_step += 1
-                    feature_flag = False
-                except Queue.Empty:
-                    pass
-                self.drone.send_cmd(expert_cmd)
-            else:
-                if not feature_flag:
-                    image = self.drone.get_image()
-                    navdata = self.drone.get_navdata()
-                    self.feature_extractor.extract(image)
-                    feature_flag = True
-                try:
-                    features = self.feature_queue.get(block=False)
-
-                    # Get the command associated with this state.
-                    blah = np.array([0])
-                    blah.shape = (1, 1)
-                    features = np.hstack((blah, features))
-                    x = self.dag.test(features, self.iteration)
-                    cmd = self.drone.default_cmd
-                    cmd['Y'] = 0.02
-                    cmd['X'] = x[0,0]*0.15
-                    print(x)
-                    self.feature_extractor.update(cmd, navdata)
-
-                    # Save the features and command.
-                    self.save_image(image, image_filename)
-                    self.save_features(features, features_filename)
-                    self.save_cmd(cmd, cmd_filename)
-                    self.time_step += 1
-
-                    self.drone.send_cmd(cmd)
-                    feature_flag = False
-                except Queue.Empty:
-                    pass
-                
     def test(self, args):
         pass
 
     def annotate(self, args):
         self.iteration = args.iteration
         self.trajectory = args.trajectory
-        self.time_step = 1
         self.video_rate = 5
 
         self.debug_queue.put({'MSG': 'Parrot AR 2 Flying Tool :: Annotation Mode', 'PRIORITY': 1})
@@ -231,13 +322,16 @@ class FlyTool(object):
         self.debug_queue.put({'MSG': ':: To annotate, get the optimal command using the left annolog stick and press button 5 to save.', 'PRIORITY': 1})
         self.directory = './data/%s/%s/' % (args.iteration, args.trajectory)
         self.debug_queue.put({'MSG': ':: Looking in directory %s for images and commands.' % self.directory, 'PRIORITY': 1})
+        self.frames = frame_pack.open_frames(self.directory)
 
         # Load the commands associated with this iteration and trajectory.
+        # Time steps dropped while recording have neither a frame nor a
+        # command, so the time steps with both are annotated in order.
         self.debug_queue.put({'MSG': ':: Loading drone commands.\n', 'PRIORITY': 1})
         cmd_filename = self.directory + 'drone_cmds.data'
-        f = open(cmd_filename)
-        lines = f.readlines()
-        self.cmd_drone_json = lines[self.time_step - 1]
+        self.cmds_drone = recorder.read_cmds(cmd_filename)
+        self.time_steps = [t for t in self.frames.get_time_steps() if t in self.cmds_drone]
+        self.step = 0
 
         self.debug_flag = False
         self.debugger.debug()
@@ -264,17 +358,16 @@ class FlyTool(object):
         """
         self.root.after(int(math.floor(1000.0/self.video_rate)), self.update_annotate_gui)
 
-        # Load the image.
-        image = None
-        image_filename = self.directory + '%s.jpg' % self.time_step
-        image = cv2.imread(image_filename)
-
-        if image is None:
+        if self.step == len(self.time_steps):
             self.debug_queue.put({'MSG': 'No more time-steps. Exiting...', 'PRIORITY': 1})
             self.debugger.debug()
             self.root.quit()
             return
 
+        # Load the image.
+        self.time_step = self.time_steps[self.step]
+        image = self.frames.read(self.time_step)
+
         if not self.debug_flag:
             self.debug_queue.put({'MSG': 'Starting annotation for time-step %s.' % self.time_step, 'PRIORITY': 1})
             self.debugger.debug()
@@ -282,7 +375,7 @@ class FlyTool(object):
 
         try:
             cmd_expert = self.remote_control.get_input()
-            cmd_drone = json.loads(self.cmd_drone_json)
+            cmd_drone = self.cmds_drone[self.time_step]
             annotated_image = annotate.annotate(image, cmd_drone, cmd_expert)
 
             # Display the image.
@@ -297,30 +390,17 @@ class FlyTool(object):
             if cmd_expert['A']:
                 filename = self.directory + 'expert_cmds.data'
                 self.save_cmd(cmd_expert, filename)
-                self.time_step += 1
+                self.step += 1
                 self.debug_flag = False
 
         except Queue.Empty:
             pass
 
-    def save_features(self, features, filename):
-        self.debug_queue.put({'MSG': "Saving features for time-step %s to file: %s." % (self.time_step, filename), 'PRIORITY': 1})
-        self.debugger.debug()
-        with open(filename, 'a') as out:
-            line = np.hstack(([[self.time_step]], features))
-            np.savetxt(out, line)
-
-    def save_image(self, image, filename):
-        self.debug_queue.put({'MSG': "Saving image for time-step %s to file: %s." % (self.time_step, filename), 'PRIORITY': 1})
-        self.debugger.debug()
-        # image_bgr = cv2.cvtColor(self.image, cv2.COLOR_RGB2BGR)
-        cv2.imwrite(filename, image)
-
     def save_cmd(self, cmd, filename):
         self.debug_queue.put({'MSG': "Saving command for time-step %s to file: %s." % (self.time_step, filename), 'PRIORITY': 1})
         self.debugger.debug()
         with open(filename, 'a') as f:
-            cmd_json = json.dumps(cmd) + '\n'
+            cmd_json = json.dumps(dict(cmd, TIME_STEP=self.time_step)) + '\n'
             f.write(cmd_json)
 
     def get_object_to_track(self):
@@ -0,0 +1,60 @@
+#!/usr/bin/env python2
+
+""" Frame module.
+"""
+
+import cv2
+import time
+
+
+class Frame(object):
+    """ An image captured from the drone's camera.
+
+        The gray, HSV and YCrCb versions and the downscaled copies of the image
+        are computed the first time they are asked for and cached, so each
+        conversion happens at most once per frame no matter how many feature
+        extractors and trackers use it. The image is in BGR like OpenCV gives
+        it.
+    """
+    def __init__(self, image, seq=0, timestamp=None):
+        self.image = image
+        self.seq = seq
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.cache = {}
+
+        # The latency trace of a frame from a camera (see the latency module).
+        self.trace = None
+
+    def get_gray(self):
+        return self._convert('GRAY', cv2.COLOR_BGR2GRAY)
+
+    def get_hsv(self):
+        return self._convert('HSV', cv2.COLOR_BGR2HSV)
+
+    def get_ycrcb(self):
+        return self._convert('YCrCb', cv2.COLOR_BGR2YCrCb)
+
+    def get_scaled(self, scale):
+        """ Gets the frame resized by scale, as a frame which caches its own
+            conversions.
+        """
+        if scale == 1.0:
+            return self
+        key = ('SCALED', scale)
+        if key not in self.cache:
+            image = cv2.resize(self.image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            self.cache[key] = Frame(image, self.seq, self.timestamp)
+        return self.cache[key]
+
+    def _convert(self, key, code):
+        if key not in self.cache:
+            self.cache[key] = cv2.cvtColor(self.image, code)
+        return self.cache[key]
+
+
+def as_frame(image):
+    """ Wraps the image in a frame unless it already is one.
+    """
+    if isinstance(image, Frame):
+        return image
+    return Frame(image)
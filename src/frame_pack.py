@@ -0,0 +1,117 @@
+#!/usr/bin/env python2
+
+""" Frame pack module.
+
+    Packs the recorded frames of a trajectory into one file instead of one
+    JPEG per time step. The frames are JPEGs appended one after the other to
+    frames.pack, and frames.index holds a (time step, offset, length) row per
+    frame, so any time step can be read without reading the others.
+"""
+
+import cv2
+import os
+import numpy as np
+
+
+PACK_NAME = 'frames.pack'
+INDEX_NAME = 'frames.index'
+INDEX_DTYPE = np.dtype([('time_step', '<i8'), ('offset', '<i8'), ('length', '<i8')])
+
+
+class FramePackWriter(object):
+    """ Appends frames to the frame pack of a directory, creating it if need
+        be.
+
+        A frame's index row is written after the frame itself, so the index
+        never points past the end of the pack even if the writer dies.
+    """
+    def __init__(self, directory, quality=90):
+        self.quality = quality
+        self.pack = open(os.path.join(directory, PACK_NAME), 'ab')
+        self.index = open(os.path.join(directory, INDEX_NAME), 'ab')
+        self.pack.seek(0, os.SEEK_END)
+        self.offset = self.pack.tell()
+        self.row = np.zeros(1, dtype=INDEX_DTYPE)
+
+    def write(self, time_step, image):
+        (ret, jpg) = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ret:
+            raise IOError('unable to encode the frame of time-step %s' % time_step)
+        data = jpg.tostring()
+        self.pack.write(data)
+        self.row[0] = (time_step, self.offset, len(data))
+        self.offset += len(data)
+        self.index.write(self.row.tostring())
+
+    def flush(self):
+        self.pack.flush()
+        self.index.flush()
+
+    def close(self):
+        self.pack.close()
+        self.index.close()
+
+
+class FramePack(object):
+    """ Reads the frames of the frame pack of a directory by time step.
+
+        The pack is memory mapped, so reading a frame only touches its own
+        bytes.
+    """
+    def __init__(self, directory):
+        pack_filename = os.path.join(directory, PACK_NAME)
+        with open(os.path.join(directory, INDEX_NAME), 'rb') as f:
+            data = f.read()
+        index = np.frombuffer(data, dtype=INDEX_DTYPE, count=len(data)//INDEX_DTYPE.itemsize)
+        size = os.path.getsize(pack_filename)
+
+        # Leave out frames which didn't make it to the pack, and keep the
+        # newest frame of a time step recorded twice.
+        index = index[index['offset'] + index['length'] <= size]
+        (self.time_steps, last) = np.unique(index['time_step'][::-1], return_index=True)
+        self.index = index[::-1][last]
+        self.pack = np.memmap(pack_filename, dtype=np.uint8, mode='r') if size else None
+
+    def __len__(self):
+        return len(self.time_steps)
+
+    def get_time_steps(self):
+        """ Gets the time steps which have a frame, in order.
+        """
+        return [int(t) for t in self.time_steps]
+
+    def read(self, time_step):
+        """ Gets the frame of the time step, or None if there is none.
+        """
+        i = np.searchsorted(self.time_steps, time_step)
+        if i == len(self.time_steps) or self.time_steps[i] != time_step:
+            return None
+        (_, offset, length) = self.index[i]
+        return cv2.imdecode(self.pack[offset:offset + length], cv2.IMREAD_COLOR)
+
+
+class ImageDirectory(object):
+    """ Reads the frames of a directory of <time step>.jpg images by time step.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_time_steps(self):
+        """ Gets the time steps which have a frame, in order.
+        """
+        names = [os.path.splitext(name) for name in os.listdir(self.directory)]
+        return sorted(int(base) for (base, ext) in names if ext == '.jpg' and base.isdigit())
+
+    def read(self, time_step):
+        """ Gets the frame of the time step, or None if there is none.
+        """
+        return cv2.imread(os.path.join(self.directory, '%s.jpg' % time_step))
+
+
+def open_frames(directory):
+    """ Opens the recorded frames of a trajectory directory, whether they are
+        packed or one JPEG per time step.
+    """
+    if os.path.exists(os.path.join(directory, INDEX_NAME)):
+        return FramePack(directory)
+    return ImageDirectory(directory)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python2
+
+""" Latency module.
+
+    Traces how long each frame takes on its way from the camera to the
+    command it leads to, and keeps the latencies of each stage to report
+    their percentiles.
+"""
+
+import threading
+import time
+import numpy as np
+from contextlib import contextmanager
+
+
+class Trace(object):
+    """ The timeline of one frame.
+
+        Marks are the times the frame reached a stage, reported as the time
+        since it was captured (e.g. 'capture->features'), and durations are
+        the time spent in a stage, added up if it runs more than once (e.g.
+        the flow of every window).
+    """
+    def __init__(self, start):
+        self.start = start
+        self.marks = []
+        self.durations = {}
+        self.order = []
+
+    def mark(self, stage, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        self.marks.append((stage, timestamp))
+
+    def add(self, stage, seconds):
+        if stage not in self.durations:
+            self.durations[stage] = 0.0
+            self.order.append(stage)
+        self.durations[stage] += seconds
+
+
+@contextmanager
+def timed(trace, stage):
+    """ Adds the time spent in the block to the stage of the trace, if there
+        is a trace.
+    """
+    if trace is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        trace.add(stage, time.time() - start)
+
+
+class LatencyStats(object):
+    """ Keeps the last size latencies of every stage and reports their
+        percentiles. Stages are reported in the order they were first seen.
+    """
+    def __init__(self, size=4096):
+        self.size = size
+        self.lock = threading.Lock()
+        self.stages = []
+        self.samples = {}
+        self.counts = {}
+
+    def record(self, stage, seconds):
+        with self.lock:
+            if stage not in self.samples:
+                self.stages.append(stage)
+                self.samples[stage] = np.zeros(self.size)
+                self.counts[stage] = 0
+            self.samples[stage][self.counts[stage] % self.size] = seconds
+            self.counts[stage] += 1
+
+    def record_trace(self, trace):
+        """ Records the marks and durations of the trace.
+        """
+        for stage in trace.order:
+            self.record(stage, trace.durations[stage])
+        for (stage, timestamp) in trace.marks:
+            self.record('capture->%s' % stage, timestamp - trace.start)
+
+    def get_percentiles(self, percentiles=(50, 95, 99)):
+        """ Gets a list of (stage, count, percentiles) tuples with the
+            percentiles of the kept latencies in seconds.
+        """
+        result = []
+        with self.lock:
+            for stage in self.stages:
+                count = self.counts[stage]
+                samples = self.samples[stage][:min(count, self.size)]
+                result.append((stage, count, np.percentile(samples, percentiles)))
+        return result
+
+    def report(self):
+        """ Gets a table of the p50, p95 and p99 latencies of each stage in
+            milliseconds.
+        """
+        lines = ['%-28s %8s %8s %8s %8s' % ('stage', 'count', 'p50', 'p95', 'p99')]
+        for (stage, count, values) in self.get_percentiles():
+            lines.append('%-28s %8d %8.1f %8.1f %8.1f' % ((stage, count) + tuple(1000*values)))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.report()
@@ -4,9 +4,12 @@
 """
 
 import json
+import os
 import numpy as np
 from sklearn.linear_model import Ridge
 
+import trajectory
+
 
 class DAgger(object):
     """ DAgger algorithm.
@@ -19,63 +22,38 @@ class DAgger(object):
         # curve.
         self.alpha = 0.5
 
-        # Load the previous aggregate.
-        self.aggregate_features_filename = './data/aggregate_features.data'
+        # The aggregate of the data. The features of every trajectory are
+        # kept in one trajectory file (see the trajectory module).
+        self.aggregate_features_filename = './data/aggregate_trajectory.bin'
         self.aggregate_cmds_filename = './data/aggregate_cmds.data'
 
-        # Load the features into numpy.
-        try:
-            self.features = self.load_features(self.aggregate_features_filename)
-        except IOError:
-            self.features = ''
-
-        # Load the cmds into numpy.
-        try:
-            self.cmds = self.load_cmds(self.aggregate_cmds_filename)
-        except IOError:
-            self.cmds = ''
-
     def aggregate(self, iterations):
-        """ Aggregate the data.
+        """ Aggregate the data of every trajectory of the iterations.
         """
-        # Get the dataset corresponding to the current itteration.
+        trajectory_filenames = []
+        cmds = ''
         for i in range(1, iterations+1):
-            # Load the current data.
             current_directory = './data/%s/' % i
 
             cur_trajectory = 1
             while True:
-                features_filename = current_directory + '%s/features.data' % cur_trajectory
+                trajectory_filename = current_directory + '%s/trajectory.bin' % cur_trajectory
                 cmds_filename = current_directory + '%s/expert_cmds.data' % cur_trajectory
-                try:
-                    cur_features = self.load_features(features_filename)
-                    cur_cmds = self.load_cmds(cmds_filename)
-                    self.features += cur_features
-                    self.cmds += cur_cmds
-                    cur_trajectory += 1
-                except:
+                if not os.path.exists(trajectory_filename) or not os.path.exists(cmds_filename):
                     break
+                trajectory_filenames.append(trajectory_filename)
+                cmds += self.load_cmds(cmds_filename)
+                cur_trajectory += 1
 
-        # Write the data to the aggregate file.
-        with open(self.aggregate_features_filename, 'w') as f:
-            f.write(self.features) 
+        # Write the data to the aggregate files.
+        trajectory.concatenate(trajectory_filenames, self.aggregate_features_filename)
         with open(self.aggregate_cmds_filename, 'w') as f:
-            f.write(self.cmds)
+            f.write(cmds)
 
     def load_features(self, filename):
-        with open(filename, 'r') as f:
-            features_str = f.read()
-        return features_str
-
-    def parse_features(self, features_str):
-        features_np = None
-        features_str = features_str.split('\n')
-        features_str = [i for i in features_str if i != '']
-        for i in range(0, len(features_str)):
-            cur_features_str = features_str[i].split(' ')
-            cur_features_np = np.loadtxt(cur_features_str)
-            features_np = np.vstack((features_np, cur_features_np)) if features_np is not None else cur_features_np
-        return features_np
+        """ Gets the features of a trajectory file, a view of its memory map.
+        """
+        return trajectory.Trajectory(filename).features
 
     def load_cmds(self, filename):
         # Only uses X for now.
@@ -105,9 +83,8 @@ class DAgger(object):
         """ Trains the ridge regressor on the aggregate of the data.
         """
         # Load the aggregate data.
-        aggregate_features_str = self.load_features(self.aggregate_features_filename)
+        aggregate_features = self.load_features(self.aggregate_features_filename)
         aggregate_cmds_str = self.load_cmds(self.aggregate_cmds_filename)
-        aggregate_features = self.parse_features(aggregate_features_str)
         aggregate_cmds = self.parse_cmds(aggregate_cmds_str)
 
         self.ridge = Ridge(alpha=self.alpha)
@@ -125,8 +102,7 @@ def _test_dagger():
     iteration = 1
     d = DAgger('tikhonov')
     d.train()
-    features = d.load_features('./data/1/1/features.data')
-    features = d.parse_features(features) 
+    features = d.load_features('./data/1/1/trajectory.bin')
     pdb.set_trace()
     value = d.test(features, 1)
     
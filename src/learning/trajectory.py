@@ -0,0 +1,151 @@
+#!/usr/bin/env python2.7
+
+""" Binary trajectory files.
+
+    A trajectory file holds a row of little-endian float32 columns per time
+    step: the time step, the features and the command sent to the drone. It
+    starts with a header giving the names of the columns and is padded to a
+    multiple of the page size, so the rows of a whole trajectory (or of the
+    aggregate of many) can be read with a single memory map.
+
+    The rows are appended in chunks as they are recorded and the number of
+    rows is taken from the size of the file, so a file cut short by a crash is
+    still read up to its last whole row.
+"""
+
+import json
+import os
+import struct
+import numpy as np
+
+
+MAGIC = 'TRAJ'
+VERSION = 1
+PREFIX = struct.Struct('<4sIQ')   # magic, version, header size
+PAGE_SIZE = 4096
+DTYPE = np.dtype('<f4')
+
+TIME_STEP_COLUMN = 'TIME_STEP'
+CMD_COLUMNS = ['CMD_X', 'CMD_Y', 'CMD_Z', 'CMD_R']
+
+
+def get_columns(feature_columns):
+    """ Gets the names of the columns of a trajectory with the features.
+    """
+    return [TIME_STEP_COLUMN] + list(feature_columns) + CMD_COLUMNS
+
+
+def write_header(f, columns):
+    header = json.dumps({'dtype': DTYPE.str, 'columns': columns})
+    size = PREFIX.size + len(header) + 1
+    size = -(-size//PAGE_SIZE)*PAGE_SIZE
+    f.write(PREFIX.pack(MAGIC, VERSION, size))
+    f.write(header + '\n')
+    f.write(' '*(size - PREFIX.size - len(header) - 1))
+
+
+def read_header(filename):
+    """ Reads the header of a trajectory file and returns its columns and the
+        offset of its rows.
+    """
+    with open(filename, 'rb') as f:
+        prefix = f.read(PREFIX.size)
+        if len(prefix) < PREFIX.size:
+            raise ValueError('%s is not a trajectory file' % filename)
+        (magic, version, size) = PREFIX.unpack(prefix)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %s trajectory file' % (filename, VERSION))
+        header = json.loads(f.read(size - PREFIX.size))
+    return (header['columns'], size)
+
+
+class TrajectoryWriter(object):
+    """ Appends time steps to a trajectory file, creating it if need be.
+    """
+    def __init__(self, filename, feature_columns):
+        self.filename = filename
+        self.columns = get_columns(feature_columns)
+        self.width = len(self.columns)
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            (columns, offset) = read_header(filename)
+            if columns != self.columns:
+                raise ValueError('%s has different columns' % filename)
+            self.f = open(filename, 'r+b')
+            # Drop a row cut short by a crash.
+            rows = (os.path.getsize(filename) - offset)//(self.width*DTYPE.itemsize)
+            self.f.truncate(offset + rows*self.width*DTYPE.itemsize)
+            self.f.seek(0, os.SEEK_END)
+        else:
+            self.f = open(filename, 'wb')
+            write_header(self.f, self.columns)
+
+    def write(self, time_steps, features, cmds):
+        """ Appends a chunk of time steps, with an array of features and a
+            command dictionary for each.
+        """
+        rows = np.empty((len(time_steps), self.width), dtype=DTYPE)
+        rows[:, 0] = time_steps
+        for (i, feats) in enumerate(features):
+            rows[i, 1:-len(CMD_COLUMNS)] = np.ravel(feats)
+        for (i, cmd) in enumerate(cmds):
+            rows[i, -len(CMD_COLUMNS):] = (cmd['X'], cmd['Y'], cmd['Z'], cmd['R'])
+        self.f.write(rows.tostring())
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class Trajectory(object):
+    """ The rows of a trajectory file, memory mapped read only.
+
+        The features include the time step column, which the learner is
+        trained on as well, and are a view of the rows like the time steps and
+        commands.
+    """
+    def __init__(self, filename):
+        (self.columns, offset) = read_header(filename)
+        width = len(self.columns)
+        rows = (os.path.getsize(filename) - offset)//(width*DTYPE.itemsize)
+        if rows:
+            self.rows = np.memmap(filename, dtype=DTYPE, mode='r', offset=offset, shape=(rows, width))
+        else:
+            self.rows = np.zeros((0, width), dtype=DTYPE)
+        self.time_steps = self.rows[:, 0]
+        self.features = self.rows[:, :-len(CMD_COLUMNS)]
+        self.cmds = self.rows[:, -len(CMD_COLUMNS):]
+
+    def __len__(self):
+        return self.rows.shape[0]
+
+
+def concatenate(filenames, out_filename, chunk_size=1 << 20):
+    """ Writes the rows of the trajectory files one after the other to a new
+        trajectory file. The files must have the same columns.
+    """
+    if not filenames:
+        raise ValueError('there are no trajectories to concatenate')
+    columns = None
+    with open(out_filename, 'wb') as out:
+        for filename in filenames:
+            (cur_columns, offset) = read_header(filename)
+            if columns is None:
+                columns = cur_columns
+                write_header(out, columns)
+            elif cur_columns != columns:
+                raise ValueError('%s has different columns' % filename)
+
+            # Copy the whole rows only.
+            row_size = len(columns)*DTYPE.itemsize
+            remaining = (os.path.getsize(filename) - offset)//row_size*row_size
+            with open(filename, 'rb') as f:
+                f.seek(offset)
+                while remaining:
+                    data = f.read(min(chunk_size, remaining))
+                    if not data:
+                        break
+                    out.write(data)
+                    remaining -= len(data)
+    return columns
@@ -6,8 +6,7 @@
 """
 
 import cv2
-import json
-import Queue
+import time
 import numpy as np
 
 # Local modules.
@@ -15,20 +14,82 @@ import remote
 import camera
 import controller
 import debug
+import event_loop
 import receiver
+import replay
+from raspi import mjpeg
 
 # Tracking modules.
 from tracking import bounding_box
 from tracking import cam_shift
 
 
+class EndOfStream(Exception):
+    """ Raised when a frame is asked for after the camera's stream has ended
+        (e.g. a replay has played to the end).
+    """
+    pass
+
+
+class Snapshot(object):
+    """ A frame with the navigation data and remote command nearest to it in
+        time.
+
+        The skews are the times the navigation data arrived and the command
+        was read minus the time the frame was captured, in seconds.
+    """
+    def __init__(self, frame, navdata, nav_time, cmd, cmd_time):
+        self.frame = frame
+        self.navdata = navdata
+        self.nav_time = nav_time
+        self.cmd = cmd
+        self.cmd_time = cmd_time
+
+    @property
+    def timestamp(self):
+        return self.frame.timestamp
+
+    @property
+    def nav_skew(self):
+        if self.nav_time is None:
+            return None
+        return self.nav_time - self.frame.timestamp
+
+    @property
+    def cmd_skew(self):
+        if self.cmd_time is None:
+            return None
+        return self.cmd_time - self.frame.timestamp
+
+    @property
+    def skew(self):
+        """ The time between the earliest and the latest of the frame, the
+            navigation data and the command.
+        """
+        times = [t for t in (self.frame.timestamp, self.nav_time, self.cmd_time) if t is not None]
+        return max(times) - min(times)
+
+
 class Parrot(object):
     """ Encapsulates the AR Parrot Drone 2.0.
 
         Allows access to the drone's front and bottom cameras, the ability to
         send commands, and the ability to read the drone's navigation data.
+
+        If video is given, frames are replayed from that video file or
+        trajectory directory instead of the drone's camera, with the
+        replay_mode and replay_rate of a replay.Replay. If video is an http://
+        address, frames are read from that MJPEG stream (e.g. the Raspberry Pi
+        camera).
+
+        Only the nav_fields of the navigation data are requested from the
+        server, as compact records; if None the whole of it is sent as JSON.
+
+        The navigation data and command sockets are served by one event loop
+        thread, so neither getting the navigation data nor sending a command
+        waits on the network.
     """
-    def __init__(self, debug_queue, error_queue, address, learning, iteration, trajectory):
+    def __init__(self, debug_queue, error_queue, address, learning, iteration, trajectory, decode='always', video=None, replay_mode='realtime', replay_rate=None, nav_fields=receiver.NAV_FIELDS):
         (self.controller_address, self.receiver_address) = address
         self.debug_queue = debug_queue
         self.error_queue = error_queue
@@ -71,12 +132,20 @@ class Parrot(object):
 
         # Initialize all modules.
         self.remote = remote.Remote(self.debug_queue, self.error_queue)
-        self.controller = controller.Controller(self.debug_queue, self.error_queue)
-        self.receiver = receiver.Receiver(self.debug_queue, self.error_queue)
+        self.loop = event_loop.EventLoop(self.error_queue)
+        self.loop.start()
+        self.controller = controller.Controller(self.debug_queue, self.error_queue, loop=self.loop)
+        self.receiver = receiver.Receiver(self.debug_queue, self.error_queue, fields=nav_fields, loop=self.loop)
 
         camera_address = 'tcp://' + self.drone_address + ':' + str(self.ports['VIDEO'])
-        self.image_queue = Queue.Queue(maxsize=1)
-        self.camera = camera.Camera(self.debug_queue, self.error_queue, camera_address, self.image_queue)
+        self.mailbox = camera.FrameMailbox()
+        self.last_seq = 0
+        if video is None:
+            self.camera = camera.Camera(self.debug_queue, self.error_queue, camera_address, self.mailbox, decode)
+        elif video.startswith('http://'):
+            self.camera = mjpeg.MjpegStream(self.debug_queue, self.error_queue, video, self.mailbox)
+        else:
+            self.camera = replay.Replay(self.debug_queue, self.error_queue, video, self.mailbox, replay_mode, replay_rate)
         self.camera.daemon = True
         self.camera.start()
 
@@ -85,16 +154,55 @@ class Parrot(object):
         return navdata
 
     def get_image(self):
-        image = self.image_queue.get(block=True)
-        return image
+        """ Gets the image of the newest frame. Raises EndOfStream once the
+            camera's stream has ended.
+        """
+        return self.get_frame().image
+
+    def get_frame(self, timeout=None):
+        """ Gets the newest frame from the camera, waiting for one if it has
+            already been gotten. Returns None if the timeout runs out and
+            raises EndOfStream once the camera's stream has ended.
+        """
+        frame = self.mailbox.get(newer_than=self.last_seq, timeout=timeout)
+        if frame is None:
+            if self.mailbox.closed:
+                raise EndOfStream()
+            return None
+        self.last_seq = frame.seq
+        if frame.trace is not None:
+            frame.trace.mark('get')
+        return frame
+
+    def snapshot(self, timeout=None, get_cmd=True):
+        """ Gets the newest frame together with the navigation data which
+            arrived nearest to when it was captured and, if get_cmd is set,
+            the remote command read right after. Returns None if the timeout
+            runs out waiting for a frame and raises EndOfStream once the
+            camera's stream has ended.
+        """
+        frame = self.get_frame(timeout)
+        if frame is None:
+            return None
+        (navdata, nav_time) = self.receiver.get_nearest(frame.timestamp, timeout)
+        (cmd, cmd_time) = (None, None)
+        if get_cmd:
+            cmd = self.get_cmd()
+            cmd_time = time.time()
+        return Snapshot(frame, navdata, nav_time, cmd, cmd_time)
 
     def get_cmd(self):
         cmd = self.remote.get_input()
         return cmd
 
-    def send_cmd(self, cmd):
-        cmd_json = json.dumps(cmd)
-        self.controller.send_cmd(cmd_json)
+    def send_cmd(self, cmd, trace=None):
+        """ Sends the command, marking when it was sent on the latency trace
+            of the frame it was decided from, if given.
+        """
+        seq = self.controller.send_cmd(cmd)
+        if trace is not None:
+            trace.mark('command')
+        return seq
 
     def exit(self):
         """ Lands the drone, closes all cv windows and exits.
@@ -131,6 +239,59 @@ def _test_parrot():
         if key == ord('q'):
             break
 
+def _test_replay_to_end():
+    """ Replays a short trajectory to the end against the simulator and makes
+        sure the end of the stream is reported. Run from src with
+        SDL_VIDEODRIVER=dummy if there is no display for the remote.
+    """
+    import Queue
+    import shutil
+    import tempfile
+    import threading
+    import frame_pack
+    import simulator
+
+    # Record a few frames as a frame pack.
+    num_frames = 5
+    directory = tempfile.mkdtemp()
+    image = cv2.imread('../samples/test_forest.jpg')
+    writer = frame_pack.FramePackWriter(directory)
+    for time_step in range(1, num_frames + 1):
+        writer.write(time_step, image)
+    writer.close()
+
+    # Serve the commands and navigation data.
+    sim = simulator.Simulator(simulator.read_navdata('../samples/sample_navdata.txt'), [])
+    for (port, handler) in [(9000, simulator.CommandHandler), (9001, simulator.NavdataHandler)]:
+        server = simulator.Server(port, handler, sim)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    error_queue = Queue.Queue()
+    debug_queue = Queue.Queue()
+    try:
+        drone = Parrot(debug_queue, error_queue, ('localhost:9000', 'localhost:9001'), 'tikhonov', 1, 1,
+                       video=directory, replay_mode='fast')
+        count = 0
+        try:
+            while True:
+                drone.snapshot(get_cmd=False)
+                count += 1
+        except EndOfStream:
+            pass
+        assert count == num_frames
+        try:
+            drone.get_image()
+            assert False, 'a frame after the end of the stream'
+        except EndOfStream:
+            pass
+        assert error_queue.empty()
+    finally:
+        shutil.rmtree(directory)
+    print('Success.')
+
+
 if __name__ == '__main__':
     import pdb
     _test_parrot()
@@ -12,78 +12,100 @@ var client  = arDrone.createClient();
 var cmdPort = 9000;
 var recvPort = 9001;
 
-// Server that listens for incoming commands for the drone.
+// Carries out a command query on the drone.
+var camera = 0;
+function runCommand(query) {
+    if (query.X > 0) {
+        console.log('Receiving command to fly right at speed ' + query.X + '.');
+        client.right(query.X);
+    }
+    if (query.X < 0) {
+        console.log('Receiving command to fly left at speed ' + Math.abs(query.X) + '.');
+        client.left(Math.abs(query.X));
+    }
+    if (query.Y > 0) {
+        console.log('Receiving command to fly forward at speed ' + query.Y + '.');
+        client.front(query.Y);
+    }
+    if (query.Y < 0) {
+        console.log('Receiving command to fly backward at speed ' + Math.abs(query.Y) + '.');
+        client.back(Math.abs(query.Y));
+    }
+    if (query.Z > 0) {
+        console.log('Receiving command to fly up at speed ' + query.Z + '.');
+        client.up(query.Z);
+    }
+    if (query.Z < 0) {
+        console.log('Receiving command to fly down at speed ' + Math.abs(query.Z) + '.');
+        client.down(Math.abs(query.Z));
+    }
+    if (query.R > 0) {
+        console.log('Receiving command to turn right at speed ' + query.R + '.');
+        client.clockwise(query.R);
+    }
+    if (query.R < 0) {
+        console.log('Receiving command to turn left at speed ' + Math.abs(query.R) + '.');
+        client.counterClockwise(Math.abs(query.R));
+    }
+    if (query.T) {
+        console.log('Receiving command to takeoff.');
+        client.takeoff();
+    }
+    if (query.L) {
+        console.log('Receiving command to land.');
+        client.land();
+    }
+    if (query.C) {
+        if (camera == 0) {
+            camera = 3;
+            console.log('Receiving command to serve the bottom camera stream');
+            client.config('video:video_channel', 3);
+        }
+        else if (camera == 3) {
+            camera = 0;
+            console.log('Receiving command to serve the front cammera stream');
+            client.config('video:video_channel', 0)
+        }
+    }
+    if (query.S) {
+        console.log('Receiving command to stop.');
+        client.stop();
+    }
+}
+
+// Server that listens for incoming commands for the drone. Every command is
+// a line of JSON, and if it has a sequence number 'SEQ' a line acknowledging
+// it is sent back once it has been carried out.
 console.log(':: Creating socket net server for receiving commands.');
 var cmdServer = net.createServer(function(socket) {
     // The socket has been opened.
     console.log('New connection from ' + socket.remoteAddress + ':' + socket.remotePort + '.');
+    socket.setNoDelay(true);
 
-    // This code will run when new data arives.
+    // This code will run when new data arives. Commands may arrive split or
+    // several at once, so they are split into lines first.
+    var pending = '';
     socket.on('data', function(data) {
-        var query;
-        try {
-            var query = JSON.parse(data);
-            if (query.X > 0) {
-                console.log('Receiving command to fly right at speed ' + query.X + '.');
-                client.right(query.X);
-            }
-            if (query.X < 0) {
-                console.log('Receiving command to fly left at speed ' + Math.abs(query.X) + '.');
-                client.left(Math.abs(query.X));
-            }
-            if (query.Y > 0) {
-                console.log('Receiving command to fly forward at speed ' + query.Y + '.');
-                client.front(query.Y);
-            }
-            if (query.Y < 0) {
-                console.log('Receiving command to fly backward at speed ' + Math.abs(query.Y) + '.');
-                client.back(Math.abs(query.Y));
-            }
-            if (query.Z > 0) {
-                console.log('Receiving command to fly up at speed ' + query.Z + '.');
-                client.up(query.Z);
+        var lines = (pending + data).split('\n');
+        pending = lines.pop();
+        lines.forEach(function(line) {
+            if (!line) {
+                return;
             }
-            if (query.Z < 0) {
-                console.log('Receiving command to fly down at speed ' + Math.abs(query.Z) + '.');
-                client.down(Math.abs(query.Z));
+            var query;
+            try {
+                query = JSON.parse(line);
             }
-            if (query.R > 0) {
-                console.log('Receiving command to turn right at speed ' + query.R + '.');
-                client.clockwise(query.R);
+            catch (e) {
+                // Parsed query is not a valid json object.
+                console.log('Error: received query is not valid json.');
+                return;
             }
-            if (query.R < 0) {
-                console.log('Receiving command to turn left at speed ' + Math.abs(query.R) + '.');
-                client.counterClockwise(Math.abs(query.R));
+            runCommand(query);
+            if (query.SEQ !== undefined) {
+                socket.write(JSON.stringify({ACK: query.SEQ}) + '\n');
             }
-            if (query.T) {
-                console.log('Receiving command to takeoff.');
-                client.takeoff();
-            }
-            if (query.L) {
-                console.log('Receiving command to land.');
-                client.land();
-            }
-            if (query.C) {
-                if (camera == 0) {
-                    camera = 3;
-                    console.log('Receiving command to serve the bottom camera stream');
-                    client.config('video:video_channel', 3);
-                }
-                else if (camera == 3) {
-                    camera = 0;
-                    console.log('Receiving command to serve the front cammera stream');
-                    client.config('video:video_channel', 0)
-                }
-            }
-            if (query.S) {
-                console.log('Receiving command to stop.');
-                client.stop();
-            }
-        }
-        catch (e) {
-            // Parsed query is not a valid json object.
-            console.log('Error: received query is not valid json.');
-        }
+        });
     });
 
     // This code will run when the connection closes.
@@ -97,36 +119,98 @@ cmdServer.listen(cmdPort, function(){
     console.log(':: Listening for commands on port ' + cmdPort + '.');
 });
 
+// Gets the value of a dotted path (e.g. 'demo.rotation.yaw') in the
+// navigation data, or undefined if it is missing.
+function getField(data, path) {
+    var value = data;
+    var keys = path.split('.');
+    for (var i = 0; i < keys.length; i++) {
+        if (value === undefined || value === null) {
+            return undefined;
+        }
+        value = value[keys[i]];
+    }
+    return value;
+}
+
+// Packs the selected fields of the navigation data into a record of
+// little-endian doubles, NaN where a field is missing or not a number.
+function packFields(data, fields) {
+    var record = new Buffer(8*fields.length);
+    for (var i = 0; i < fields.length; i++) {
+        var value = getField(data, fields[i]);
+        record.writeDoubleLE(typeof value === 'number' ? value : NaN, 8*i);
+    }
+    return record;
+}
+
 // Server that listens for a 'N' flag and sends the drone's navigation data.
+// Every message is a line of JSON. A query with the 'SUB' flag subscribes the
+// client, and from then on every navigation data packet is pushed to it as
+// soon as it arrives. A query with a 'FIELDS' list of dotted paths selects
+// those fields, and from then on they are sent as a fixed size record of
+// little-endian doubles instead of JSON.
 console.log(':: Creating socket net server for sending navigation data.');
 var recvServer = net.createServer(function(socket) {
     // The socket has been opened.
     console.log('New connection from ' + socket.remoteAddress + ':' + socket.remotePort + '.');
+    socket.setNoDelay(true);
 
     // Grab the navigation data.
     var navdata;
-    client.on('navdata', function(data) {
-        navdata = data
-    });
+    var subscribed = false;
+    var fields = null;
+    var encode = function(data) {
+        if (fields) {
+            return packFields(data, fields);
+        }
+        return JSON.stringify(data === undefined ? null : data) + '\n';
+    };
+    var onNavdata = function(data) {
+        navdata = data;
+        if (subscribed) {
+            socket.write(encode(navdata));
+        }
+    };
+    client.on('navdata', onNavdata);
 
-    // This code will run when new data arives.
+    // This code will run when new data arives. Queries may arrive split or
+    // several at once, so they are split into lines first.
+    var pending = '';
     socket.on('data', function(data) {
-        var query;
-        try {
-            var query = JSON.parse(data);
-            if (query.N) {
-                console.log('Received query to send navigation data.');
-                console.log('Sending navigation data to client.')
-                socket.write(JSON.stringify(navdata));
+        var lines = (pending + data).split('\n');
+        pending = lines.pop();
+        lines.forEach(function(line) {
+            if (!line) {
+                return;
             }
-        }
-        catch (e) {
-            // Parsed query is not a valid json object.
-            console.log('Error: received query is not valid json.');
-        }
+            var query;
+            try {
+                query = JSON.parse(line);
+            }
+            catch (e) {
+                // Parsed query is not a valid json object.
+                console.log('Error: received query is not valid json.');
+                return;
+            }
+            if (query.N && Array.isArray(query.FIELDS)) {
+                fields = query.FIELDS;
+            }
+            if (query.N && query.SUB) {
+                console.log('Received query to subscribe to navigation data.');
+                subscribed = true;
+            }
+            else if (query.N) {
+                // Nothing has arrived from the drone yet if navdata is unset.
+                socket.write(encode(navdata));
+            }
+        });
     });
 
     // This code will run when the connection closes.
+    socket.on('close', function() {
+        client.removeListener('navdata', onNavdata);
+    });
     socket.on('end', function() {
         console.log('Closing connection with ' + socket.remoteAddress + ':' + socket.remotePort + '.');
     });
@@ -0,0 +1,132 @@
+#!/usr/bin/env python2.7
+
+""" MJPEG stream module.
+
+    Receives the MJPEG stream served by mjpg-streamer on the Raspberry Pi (see
+    start.sh) and puts its frames in a frame mailbox, like the drone's camera.
+"""
+
+import cv2
+import socket
+import sys
+import threading
+import time
+import urlparse
+import numpy as np
+
+import debug
+
+
+class MjpegParser(object):
+    """ Splits a byte stream into JPEG images.
+
+        The bytes are received straight into one reusable buffer and scanned
+        for the start and end of image markers incrementally, so each byte is
+        copied and scanned about once. Only the newest complete image in the
+        buffer is decoded.
+
+        Bytes before the start of an image are dropped as they are scanned,
+        and the buffer grows to at most max_size bytes: an image which doesn't
+        fit is dropped, so a stream which isn't JPEG can't use up the memory.
+    """
+    def __init__(self, size=1 << 20, max_size=1 << 24):
+        self.buf = bytearray(size)
+        self.max_size = max_size
+        self.start = 0   # start of the unparsed bytes
+        self.end = 0     # end of the received bytes
+        self.scan = 0    # where to continue looking for a marker
+        self.soi = -1    # start of the image being received
+
+    def get_free(self, min_free=65536):
+        """ Gets a writable view of the free end of the buffer to receive into,
+            making room for at least min_free bytes.
+        """
+        if len(self.buf) - self.end < min_free:
+            # Move the unparsed bytes to the front, and grow the buffer if an
+            # image is too big to fit.
+            length = self.end - self.start
+            self.buf[0:length] = self.buf[self.start:self.end]
+            self.scan -= self.start
+            self.soi = self.soi - self.start if self.soi >= 0 else -1
+            (self.start, self.end) = (0, length)
+            if len(self.buf) - self.end < min_free:
+                if 2*len(self.buf) > self.max_size:
+                    # Drop the image, keeping the last byte in case it is half
+                    # of a marker.
+                    self.buf[0] = self.buf[self.end - 1]
+                    (self.start, self.end, self.scan, self.soi) = (0, 1, 0, -1)
+                else:
+                    self.buf.extend(bytearray(len(self.buf)))
+        return memoryview(self.buf)[self.end:]
+
+    def feed(self, n):
+        """ Accounts for n bytes received into the free view and returns the
+            newest complete image decoded, or None if there is none yet.
+        """
+        self.end += n
+        jpg = None
+        while True:
+            if self.soi < 0:
+                self.soi = self.buf.find(b'\xff\xd8', self.scan, self.end)
+                if self.soi < 0:
+                    # Drop the bytes before any image, keeping the last byte
+                    # in case it is half of a marker.
+                    self.start = self.scan = max(self.end - 1, self.start)
+                    break
+                self.scan = self.soi + 2
+            eoi = self.buf.find(b'\xff\xd9', self.scan, self.end)
+            if eoi < 0:
+                self.scan = max(self.end - 1, self.soi + 2)
+                break
+            jpg = (self.soi, eoi + 2)
+            (self.start, self.scan, self.soi) = (eoi + 2, eoi + 2, -1)
+        if jpg is None:
+            return None
+        data = np.frombuffer(self.buf, dtype=np.uint8, count=jpg[1] - jpg[0], offset=jpg[0])
+        image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        del data
+        return image
+
+
+class MjpegStream(threading.Thread):
+    """ Frame source which reads an MJPEG stream over HTTP on one persistent
+        connection and puts each image in the frame mailbox as it arrives.
+    """
+    def __init__(self, debug_queue, error_queue, address, mailbox, timeout=5.0):
+        threading.Thread.__init__(self)
+        self.debug_queue = debug_queue
+        self.error_queue = error_queue
+        self.address = address
+        self.mailbox = mailbox
+        self.timeout = timeout
+
+    def run(self):
+        try:
+            soc = self.connect()
+            parser = MjpegParser()
+            while True:
+                n = soc.recv_into(parser.get_free())
+                if n == 0:
+                    break
+                timestamp = time.time()
+                image = parser.feed(n)
+                if image is not None:
+                    self.mailbox.put(image, timestamp)
+        except Exception:
+            exc_error = sys.exc_info()
+            self.error_queue.put(debug.Error('mjpeg', '%s, %s, %s' % exc_error))
+        finally:
+            self.mailbox.close()
+
+    def connect(self):
+        """ Opens the connection and requests the stream. The HTTP headers are
+            skipped by the parser since they hold no image markers.
+        """
+        url = urlparse.urlparse(self.address)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        soc = socket.create_connection((url.hostname, url.port or 80), self.timeout)
+        soc.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        soc.sendall('GET %s HTTP/1.1\r\nHost: %s\r\nConnection: keep-alive\r\n\r\n' % (path, url.netloc))
+        return soc
@@ -1,14 +1,21 @@
 #!/usr/bin/env python2.7
 
 import cv2
+import os
 import urllib
 import numpy as np
 import png
 import pdb
 import StringIO
 import sys
+import Queue
 from PIL import Image
 
+# Use the camera and debug modules of the flying tool.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import camera
+import mjpeg
+
 
 # This works (tested) with raspberry pi and camera module but it should work with parrot too.
 def main():
@@ -41,21 +48,22 @@ def url_to_image(url):
 def get_stream_raspi():
     # Code credit: Petr Kout'
     # http://petrkout.com/electronics/low-latency-0-4-s-video-streaming-from-raspberry-pi-mjpeg-streamer-opencv/
+    # The stream is now parsed by the mjpeg module on one connection.
+    error_queue = Queue.Queue()
+    mailbox = camera.FrameMailbox()
+    stream = mjpeg.MjpegStream(None, error_queue, 'http://192.168.1.2:8080/?action=stream', mailbox)
+    stream.daemon = True
+    stream.start()
 
-    stream = urllib.urlopen('http://192.168.1.2:8080')
-    r.read()
-    ss = ''
+    seq = 0
     while True:
-        ss += stream.read(1024)
-        a = ss.find('\xff\xd8')
-        b = ss.find('\xff\xd9')
-        if a != -1 and b != -1:
-            jpg = ss[a:b + 2]
-            ss = ss[b + 2:]
-            i = cv2.imdecode(np.fromstring(jpg, dtype=np.uint8), cv2.CV_LOAD_IMAGE_COLOR)
-            cv2.imshow('opencv image server raspi test', i)
-            if cv2.waitKey(1) == 27:
-                exit(0)
+        frame = mailbox.get(newer_than=seq)
+        if frame is None:
+            break
+        seq = frame.seq
+        cv2.imshow('opencv image server raspi test', frame.image)
+        if cv2.waitKey(1) == 27:
+            exit(0)
 
 if __name__ == '__main__':
     main()
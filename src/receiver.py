@@ -3,27 +3,79 @@
 """ Receiver module.
 """
 
+import bisect
+import collections
 import debug
 import errno
 import json
+import numpy as np
 import socket
 import threading
 import time
 
 
+# The navigation data used by the navigation history, in the order it is kept.
+NAV_FIELDS = ('demo.altitude',
+              'demo.rotation.pitch',
+              'demo.rotation.roll',
+              'demo.rotation.yaw')
+
+
 class Receiver(object):
     """ Handles the receiving of navigation data from the drone.
+
+        If subscribe is set, the server pushes every navigation data packet as
+        a line of JSON and a background thread keeps the newest one, so
+        getting the navigation data doesn't wait on the network. Otherwise
+        each get sends a query and waits for the reply line.
+
+        If fields is given, only those fields (dotted paths into the
+        navigation data, e.g. 'demo.rotation.yaw') are requested, and the
+        server sends them as fixed size records of little-endian doubles
+        instead of JSON, NaN where a field is missing. The navigation data is
+        then an array of the fields in order, a view of the received record.
+
+        If loop is given, the pushed navigation data is read by that event
+        loop instead of a thread of the receiver's own.
+
+        The last history packets are kept with their arrival times so that
+        the one nearest to a given time (e.g. a frame's) can be found.
     """
-    def __init__(self, debug_queue, error_queue):
+    def __init__(self, debug_queue, error_queue, subscribe=True, fields=None, loop=None, history=64):
         self.debug_queue = debug_queue
         self.error_queue = error_queue
         self.bufsize = 8192
+        self.subscribe = subscribe
+        self.loop = loop
+        self.fields = fields
 
         query = {
             'N': True
         }
+        subscribe_query = {
+            'N': True,
+            'SUB': True
+        }
+        if self.fields is not None:
+            query['FIELDS'] = list(self.fields)
+            subscribe_query['FIELDS'] = list(self.fields)
+            self.record_dtype = np.dtype('<f8')
+            self.record_size = self.record_dtype.itemsize*len(self.fields)
         self.query_json = json.dumps(query)
+        self.subscribe_json = json.dumps(subscribe_query)
 
+        # Bytes received after the last complete message.
+        self.pending = ''
+
+        # The newest navigation data, its arrival time and how many have been
+        # received.
+        self.condition = threading.Condition()
+        self.navdata = None
+        self.timestamp = None
+        self.seq = 0
+        self.closed = False
+        self.times = collections.deque(maxlen=history)
+        self.samples = collections.deque(maxlen=history)
 
         try:
             self.soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -35,24 +87,178 @@ class Receiver(object):
             if e[0] == errno.EPIPE:
                 self.error_queue.put(debug.Error('receiver', 'bad pipe to receiver server'))
 
+        if self.subscribe and self.loop is not None:
+            try:
+                self.soc.sendall(self.subscribe_json + '\n')
+                self.soc.setblocking(0)
+                self.loop.add_reader(self.soc, self.on_readable)
+            except socket.error as e:
+                self.error_queue.put(debug.Error('receiver', 'navigation data stream failed: %s' % e))
+                self.set_closed()
+        elif self.subscribe:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        """ Subscribes to the navigation data and keeps the newest packet
+            until the connection closes.
+        """
+        try:
+            self.soc.sendall(self.subscribe_json + '\n')
+            while self.read_navdata():
+                pass
+        except socket.error as e:
+            self.error_queue.put(debug.Error('receiver', 'navigation data stream failed: %s' % e))
+        except ValueError:
+            self.error_queue.put(debug.Error('receiver', 'received navigation data is not valid'))
+        finally:
+            self.set_closed()
+
+    def on_readable(self):
+        """ Keeps the newest pushed packet when the event loop finds the
+            socket readable.
+        """
+        try:
+            if self.read_navdata():
+                return
+        except socket.error as e:
+            if e[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.error_queue.put(debug.Error('receiver', 'navigation data stream failed: %s' % e))
+        except ValueError:
+            self.error_queue.put(debug.Error('receiver', 'received navigation data is not valid'))
+        self.loop.remove_reader(self.soc)
+        self.set_closed()
+
+    def read_navdata(self):
+        """ Receives the pushed navigation data and keeps the newest packet.
+            Returns False once the connection has closed.
+        """
+        messages = self.recv_messages()
+        if messages is None:
+            return False
+        if messages:
+            # Only the newest packet is parsed, older ones are stale.
+            self.set_navdata(self.decode(messages[-1]))
+        return True
+
+    def set_closed(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def recv_messages(self):
+        """ Receives from the server and returns the complete messages
+            received (lines of JSON, or records if fields are selected), or
+            None if the connection has closed.
+        """
+        data = self.soc.recv(self.bufsize)
+        if not data:
+            return None
+        data = self.pending + data
+        if self.fields is None:
+            lines = data.split('\n')
+            self.pending = lines.pop()
+            return [line for line in lines if line]
+
+        # Only the newest complete record is kept, older ones are stale.
+        count = len(data)//self.record_size
+        end = count*self.record_size
+        self.pending = data[end:]
+        if count == 0:
+            return []
+        return [data[end - self.record_size:end]]
+
+    def decode(self, message):
+        """ Decodes a message from the server into navigation data.
+        """
+        if self.fields is None:
+            return json.loads(message)
+        return np.frombuffer(message, dtype=self.record_dtype)
+
+    def set_navdata(self, navdata):
+        with self.condition:
+            self.navdata = navdata
+            self.timestamp = time.time()
+            self.seq += 1
+            self.times.append(self.timestamp)
+            self.samples.append(navdata)
+            self.condition.notify_all()
+
     def recv_navdata(self):
         """ Gets the navigation data from the parrot by first sending a 'GET'
-            query and then receiving the data.
+            query and then receiving the reply message.
         """
         navdata = None
-        self.soc.send(self.query_json)
         try:
-            navdata = self.soc.recv(self.bufsize)
+            self.soc.sendall(self.query_json + '\n')
+            messages = []
+            while not messages:
+                messages = self.recv_messages()
+                if messages is None:
+                    self.error_queue.put(debug.Error('receiver', 'receiver server closed the connection'))
+                    return None
+            navdata = messages[-1]
         except socket.error as e:
             if e[0] == errno.ECONNREFUSED:
                 self.error_queue.put(debug.Error('receiver', 'unable to connect to receiver server'))
         return navdata
 
-    def get_navdata(self):
-        time.sleep(0.1)
-        navdata_json = self.recv_navdata()
-        navdata = json.loads(navdata_json)
-        return navdata
+    def get_navdata(self, timeout=None):
+        """ Gets the newest navigation data. When subscribed this returns at
+            once, only waiting for the first packet (or until the timeout runs
+            out, giving None).
+        """
+        if not self.subscribe:
+            message = self.recv_navdata()
+            if message is None:
+                return None
+            navdata = self.decode(message)
+            self.set_navdata(navdata)
+            return navdata
+        return self.get_sample(timeout)[0]
+
+    def get_sample(self, timeout=None):
+        """ Gets the newest navigation data with the time it arrived, waiting
+            for the first packet if none has arrived yet.
+        """
+        with self.condition:
+            self.wait_first(timeout)
+            return (self.navdata, self.timestamp)
+
+    def get_nearest(self, timestamp, timeout=None):
+        """ Gets the kept navigation data which arrived nearest to the
+            timestamp with the time it arrived, waiting for the first packet
+            if none has arrived yet.
+        """
+        with self.condition:
+            self.wait_first(timeout)
+            if not self.times:
+                return (self.navdata, self.timestamp)
+            i = bisect.bisect_left(self.times, timestamp)
+            if i == len(self.times) or (i > 0 and timestamp - self.times[i - 1] <= self.times[i] - timestamp):
+                i -= 1
+            return (self.samples[i], self.times[i])
+
+    def wait_first(self, timeout=None):
+        """ Waits for the first packet, holding the condition.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self.seq == 0 and not self.closed:
+            if deadline is None:
+                self.condition.wait()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+    def close(self):
+        if self.loop is not None:
+            # The loop stops watching the socket before it is closed.
+            self.loop.remove_reader(self.soc)
+        self.soc.close()
 
 def _test_receiver():
     pdb.set_trace()
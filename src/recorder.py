@@ -0,0 +1,138 @@
+#!/usr/bin/env python2
+
+""" Recorder module.
+"""
+
+import cv2
+import json
+import os
+import sys
+import threading
+import Queue
+
+import debug
+import frame_pack
+from learning import trajectory
+
+
+class Recorder(threading.Thread):
+    """ Records the time steps of a trajectory in the background.
+
+        Each time step (its image, features and command) is queued whole and
+        written by the recorder's thread, so the control loop never waits on
+        the disk. The thread takes up to batch_size waiting time steps at once
+        and appends their features and commands to the trajectory file (see
+        learning.trajectory) and the commands file, which are kept open and
+        flushed once per batch.
+
+        The frame_format decides how the images are written: 'jpg' for a
+        <time step>.jpg file per time step or 'pack' for one frame pack (see
+        frame_pack) per trajectory.
+
+        At most maxsize time steps wait to be written. When the queue is full
+        the policy decides: 'block' waits for room and 'drop' drops the time
+        step, counting it. A dropped time step leaves a gap in the time steps
+        recorded, so every record holds its time step (the commands too, see
+        read_cmds) and readers look them up by it rather than by position.
+    """
+    def __init__(self, debug_queue, error_queue, directory, feature_columns, frame_format='jpg', maxsize=64, policy='block', batch_size=16):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.debug_queue = debug_queue
+        self.error_queue = error_queue
+        self.directory = directory
+        self.policy = policy
+        self.batch_size = batch_size
+        self.queue = Queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.recorded = 0
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.trajectory = trajectory.TrajectoryWriter(os.path.join(self.directory, 'trajectory.bin'), feature_columns)
+        self.cmd_file = open(os.path.join(self.directory, 'drone_cmds.data'), 'a')
+        self.frames = frame_pack.FramePackWriter(self.directory) if frame_format == 'pack' else None
+
+    def record(self, time_step, image, features, cmd):
+        """ Queues the time step to be written. Returns whether it was queued,
+            which it is not if it was dropped.
+        """
+        # The image and command are copied since the camera may reuse the
+        # image's buffer and the caller the dictionary before they are written.
+        item = (time_step, image.copy(), features, dict(cmd))
+        try:
+            self.queue.put(item, block=(self.policy == 'block'))
+        except Queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def run(self):
+        while True:
+            batch = [self.queue.get(block=True)]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get(block=False))
+            except Queue.Empty:
+                pass
+            stop = None in batch
+            steps = [item for item in batch if item is not None]
+            try:
+                self.write(steps)
+            except Exception:
+                exc_error = sys.exc_info()
+                self.error_queue.put(debug.Error('recorder', '%s, %s, %s' % exc_error))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if stop:
+                break
+
+    def write(self, steps):
+        if not steps:
+            return
+        for (time_step, image, features, cmd) in steps:
+            if self.frames is not None:
+                self.frames.write(time_step, image)
+            else:
+                cv2.imwrite(os.path.join(self.directory, '%s.jpg' % time_step), image)
+            cmd['TIME_STEP'] = time_step
+            self.cmd_file.write(json.dumps(cmd) + '\n')
+        (time_steps, _, features, cmds) = zip(*steps)
+        self.trajectory.write(time_steps, features, cmds)
+        self.trajectory.flush()
+        if self.frames is not None:
+            self.frames.flush()
+        self.cmd_file.flush()
+        self.recorded += len(steps)
+        self.debug_queue.put({'MSG': 'Saved time-steps %s to %s to directory: %s.', 'ARGS': (steps[0][0], steps[-1][0], self.directory), 'PRIORITY': 1})
+
+    def flush(self):
+        """ Waits until the queued time steps have been written.
+        """
+        self.queue.join()
+
+    def close(self):
+        """ Writes the queued time steps and closes the files.
+        """
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+        self.trajectory.close()
+        if self.frames is not None:
+            self.frames.close()
+        self.cmd_file.close()
+
+
+def read_cmds(filename):
+    """ Reads a commands file into a dictionary of the commands by time step.
+        Commands recorded without their time step are taken to be in order
+        from time step 1.
+    """
+    cmds = {}
+    with open(filename, 'r') as f:
+        for (i, line) in enumerate(f):
+            if line.strip():
+                cmd = json.loads(line)
+                cmds[cmd.get('TIME_STEP', i + 1)] = cmd
+    return cmds
@@ -194,49 +194,49 @@ class Remote(object):
     def turn_left(self, speed):
         cmd = self.default_cmd.copy()
         cmd['R'] = -speed
-        self.debug_queue.put({'MSG': 'Sending command to turn left at speed %0.1f.' % self.default_speed, 'PRIORITY': 1})
+        self.debug_queue.put({'MSG': 'Sending command to turn left at speed %0.1f.', 'ARGS': (self.default_speed,), 'PRIORITY': 1})
         return cmd
 
     def turn_right(self, speed):
         cmd = self.default_cmd.copy()
         cmd['R'] = speed
-        self.debug_queue.put({'MSG': 'Sending command to turn right at speed %0.1f.' % self.default_speed, 'PRIORITY': 1})
+        self.debug_queue.put({'MSG': 'Sending command to turn right at speed %0.1f.', 'ARGS': (self.default_speed,), 'PRIORITY': 1})
         return cmd
 
     def fly_up(self, speed):
         cmd = self.default_cmd.copy()
         cmd['Z'] = speed
-        self.debug_queue.put({'MSG': 'Sending command to fly up at speed %0.1f.' % self.default_speed, 'PRIORITY': 1})
+        self.debug_queue.put({'MSG': 'Sending command to fly up at speed %0.1f.', 'ARGS': (self.default_speed,), 'PRIORITY': 1})
         return cmd
 
     def fly_down(self, speed):
         cmd = self.default_cmd.copy()
         cmd['Z'] = -speed
-        self.debug_queue.put({'MSG': 'Sending command to fly down at speed %0.1f.' % self.default_speed, 'PRIORITY': 1})
+        self.debug_queue.put({'MSG': 'Sending command to fly down at speed %0.1f.', 'ARGS': (self.default_speed,), 'PRIORITY': 1})
         return cmd
 
     def fly_forward(self, speed):
         cmd = self.default_cmd.copy()
         cmd['Y'] = speed
-        self.debug_queue.put({'MSG': 'Sending command to fly forward at speed %0.1f.' % self.default_speed, 'PRIORITY': 1})
+        self.debug_queue.put({'MSG': 'Sending command to fly forward at speed %0.1f.', 'ARGS': (self.default_speed,), 'PRIORITY': 1})
         return cmd
 
     def fly_backward(self, speed):
         cmd = self.default_cmd.copy()
         cmd['Y'] = -speed
-        self.debug_queue.put({'MSG': 'Sending command to fly backward at speed %0.1f.' % self.default_speed, 'PRIORITY': 1})
+        self.debug_queue.put({'MSG': 'Sending command to fly backward at speed %0.1f.', 'ARGS': (self.default_speed,), 'PRIORITY': 1})
         return cmd
 
     def fly_left(self, speed):
         cmd = self.default_cmd.copy()
         cmd['X'] = -speed
-        self.debug_queue.put({'MSG': 'Sending command to fly left at speed %0.1f.' % self.default_speed, 'PRIORITY': 1})
+        self.debug_queue.put({'MSG': 'Sending command to fly left at speed %0.1f.', 'ARGS': (self.default_speed,), 'PRIORITY': 1})
         return cmd
 
     def fly_right(self, speed):
         cmd = self.default_cmd.copy()
         cmd['X'] = speed
-        self.debug_queue.put({'MSG': 'Sending command to fly right at speed %0.1f.' % self.default_speed, 'PRIORITY': 1})
+        self.debug_queue.put({'MSG': 'Sending command to fly right at speed %0.1f.', 'ARGS': (self.default_speed,), 'PRIORITY': 1})
         return cmd
 
     def change_camera(self, camera):
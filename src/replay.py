@@ -0,0 +1,151 @@
+#!/usr/bin/env python2
+
+""" Replay module.
+
+    Plays back a recorded video file or a trajectory recorded by the flying
+    tool in place of the drone's camera, so the rest of the pipeline can be run
+    and timed without flying.
+"""
+
+import cv2
+import debug
+import os
+import sys
+import threading
+import time
+
+import camera
+import frame_pack
+
+
+class Replay(threading.Thread):
+    """ Frame source which reads from a video file (e.g. samples/test_cat.mp4)
+        or a trajectory directory (e.g. ./data/1/1/) of <time step>.jpg images
+        or a frame pack, and puts the frames in a frame mailbox, like the
+        camera does.
+
+        The mode can be 'realtime' to play at the rate of the video (or rate
+        frames per second for images), 'fixed' to play at rate frames per
+        second, or 'fast' to put the next frame as soon as the last one has
+        been gotten. If loop is set the source is played over and over.
+    """
+    def __init__(self, debug_queue, error_queue, source, mailbox, mode='realtime', rate=None, loop=False):
+        threading.Thread.__init__(self)
+        self.debug_queue = debug_queue
+        self.error_queue = error_queue
+        self.source = source
+        self.mailbox = mailbox
+        self.mode = mode
+        self.rate = rate
+        self.loop = loop
+
+        # Default rate of image directories in realtime mode.
+        self.default_rate = 15.0
+
+    def run(self):
+        try:
+            while True:
+                self.play()
+                if not self.loop:
+                    break
+        except Exception:
+            exc_error = sys.exc_info()
+            self.error_queue.put(debug.Error('replay', '%s, %s, %s' % exc_error))
+        finally:
+            self.mailbox.close()
+
+    def play(self):
+        if os.path.isdir(self.source):
+            (images, fps) = (self.read_images(), self.default_rate)
+        else:
+            (images, fps) = self.read_video()
+
+        if self.mode == 'realtime':
+            period = 1.0/(self.rate or fps or self.default_rate)
+        elif self.mode == 'fixed':
+            period = 1.0/self.rate
+        elif self.mode == 'fast':
+            period = 0.0
+
+        # Put each frame at its scheduled time, relative to the start so that
+        # the delays don't add up.
+        start = time.time()
+        for (i, image) in enumerate(images):
+            delay = start + i*period - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            seq = self.mailbox.put(image)
+            if self.mode == 'fast':
+                if not self.mailbox.wait_taken(seq):
+                    break
+
+    def read_video(self):
+        """ Gets a generator of the frames of the video and its frame rate.
+        """
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            raise debug.Error('replay', 'unable to open video %s' % self.source)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+
+        def frames():
+            try:
+                while True:
+                    (ret, image) = cap.read()
+                    if not ret:
+                        break
+                    yield image
+            finally:
+                cap.release()
+        return (frames(), fps)
+
+    def read_images(self):
+        """ Gets a generator of the images of a trajectory directory in order
+            of their time steps.
+        """
+        frames = frame_pack.open_frames(self.source)
+        for time_step in frames.get_time_steps():
+            image = frames.read(time_step)
+            if image is not None:
+                yield image
+
+
+def _test_replay():
+    """ Measures the throughput and latency of the feature extractor on the
+        sample video.
+    """
+    import Queue
+    from feature_extraction import feature_extractor
+
+    verbosity = 1
+    error_queue = Queue.Queue()
+    debug_queue = Queue.Queue()
+    debugger = debug.Debug(verbosity, debug_queue, error_queue)
+
+    mailbox = camera.FrameMailbox()
+    replay = Replay(debug_queue, error_queue, '../samples/test_cat.mp4', mailbox, mode='fast')
+    replay.daemon = True
+    replay.start()
+
+    frame = mailbox.get()
+    feature_queue = Queue.Queue()
+    extractor = feature_extractor.FeatureExtractor(feature_queue, frame.image, (10, 5), 0.25, 7, 10, 7, 10)
+
+    latencies = []
+    start = time.time()
+    while True:
+        debugger.debug()
+        frame = mailbox.get(newer_than=frame.seq)
+        if frame is None:
+            break
+        extractor.extract(frame)
+        feature_queue.get(block=True)
+        latencies.append(time.time() - frame.timestamp)
+    extractor.stop()
+
+    elapsed = time.time() - start
+    print('%d frames in %0.2f s (%0.2f frames/s), mean latency %0.1f ms.' %
+          (len(latencies), elapsed, len(latencies)/elapsed, 1000*sum(latencies)/len(latencies)))
+
+
+if __name__ == '__main__':
+    _test_replay()
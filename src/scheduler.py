@@ -0,0 +1,80 @@
+#!/usr/bin/env python2
+
+""" Scheduler module.
+"""
+
+import math
+import time
+
+
+class RateScheduler(object):
+    """ Ticks a control loop at a fixed rate.
+
+        Each wait sleeps until the next tick, which is scheduled relative to
+        the first one so that the delays don't add up. How late each tick
+        wakes up (its jitter) is recorded, and a tick whose deadline has
+        already passed by a whole period when it is waited for is missed: the
+        loop runs at once and the ticks it overran are skipped.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.period = 1.0/rate
+        self.start = None
+        self.tick = 0
+
+        # Stats.
+        self.ticks = 0
+        self.missed = 0
+        self.jitter_sum = 0.0
+        self.jitter_max = 0.0
+
+    def wait(self):
+        """ Waits for the next tick and returns its number.
+        """
+        now = time.time()
+        if self.start is None:
+            self.start = now
+            self.ticks = 1
+            return self.tick
+
+        self.tick += 1
+        deadline = self.start + self.tick*self.period
+        if now - deadline >= self.period:
+            # The loop overran, skip to the tick due now.
+            skipped = int(math.floor((now - deadline)/self.period))
+            self.missed += skipped
+            self.tick += skipped
+            deadline = self.start + self.tick*self.period
+        delay = deadline - now
+        if delay > 0:
+            time.sleep(delay)
+            now = time.time()
+
+        jitter = now - deadline
+        self.ticks += 1
+        self.jitter_sum += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+        return self.tick
+
+    def get_stats(self):
+        """ Gets the number of ticks run and missed, and the mean and largest
+            jitter in seconds.
+        """
+        return {
+            'TICKS': self.ticks,
+            'MISSED': self.missed,
+            'JITTER_MEAN': self.jitter_sum/max(1, self.ticks - 1),
+            'JITTER_MAX': self.jitter_max
+        }
+
+
+def _test_scheduler():
+    scheduler = RateScheduler(100.0)
+    for i in range(0, 100):
+        scheduler.wait()
+        if i == 50:
+            time.sleep(0.05)
+    print(scheduler.get_stats())
+
+if __name__ == '__main__':
+    _test_scheduler()
@@ -0,0 +1,372 @@
+#!/usr/bin/env python2
+
+""" Simulator module.
+
+    Stands in for parrot_server.js and the drone so that the flying tool can
+    be run and load tested without them. It serves the command server on port
+    9000, the navigation data server on port 9001 and the camera on port 5555,
+    with injected latency and jitter:
+
+        ./simulator.py --latency 0.02 --jitter 0.01
+        ./fly.py -v exec localhost:9000 localhost:9001 tikhonov 2 1 --video http://localhost:5555/
+
+    The navigation data is the sample navigation data (a Python literal, as
+    in samples/sample_navdata.txt) with its frame index counting up. The
+    camera serves the frames of a recorded video as an MJPEG stream, since
+    the drone's H264 stream can't be produced without an encoder. Every
+    command received is logged with the time it arrived.
+"""
+
+import argparse
+import ast
+import cv2
+import json
+import os
+import Queue
+import random
+import socket
+import struct
+import SocketServer
+import sys
+import threading
+import time
+
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'samples')
+
+
+def get_delay(latency, jitter):
+    """ Gets a delay of latency seconds give or take up to jitter seconds.
+    """
+    return max(0.0, latency + random.uniform(-jitter, jitter))
+
+
+def get_field(data, path):
+    """ Gets the value of a dotted path (e.g. 'demo.rotation.yaw') in the
+        navigation data, or None if it is missing.
+    """
+    value = data
+    for key in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def pack_fields(data, fields):
+    """ Packs the selected fields of the navigation data into a record of
+        little-endian doubles, NaN where a field is missing or not a number,
+        as parrot_server.js does.
+    """
+    values = []
+    for field in fields:
+        value = get_field(data, field)
+        is_number = isinstance(value, (int, long, float)) and not isinstance(value, bool)
+        values.append(float(value) if is_number else float('nan'))
+    return struct.pack('<%dd' % len(values), *values)
+
+
+class Simulator(object):
+    """ The state shared by the simulated servers.
+    """
+    def __init__(self, navdata, frames, nav_rate=15.0, video_rate=15.0, latency=0.0, jitter=0.0, cmd_log=None):
+        self.navdata = navdata
+        self.frames = frames
+        self.nav_rate = nav_rate
+        self.video_rate = video_rate
+        self.latency = latency
+        self.jitter = jitter
+        self.cmd_log = cmd_log
+        self.log_lock = threading.Lock()
+        self.num_cmds = 0
+
+        # The navigation data is updated at the navigation rate by one thread
+        # and waited on by the subscribed clients.
+        self.condition = threading.Condition()
+        self.nav_seq = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        """ Updates the navigation data at the navigation rate.
+        """
+        period = 1.0/self.nav_rate
+        start = time.time()
+        while True:
+            delay = start + (self.nav_seq + 1)*period - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            with self.condition:
+                self.nav_seq += 1
+                self.navdata['demo']['frameIndex'] = self.nav_seq
+                self.condition.notify_all()
+
+    def wait_navdata(self, newer_than):
+        """ Waits for navigation data newer than newer_than and returns its
+            sequence number and a copy of it.
+        """
+        with self.condition:
+            while self.nav_seq <= newer_than:
+                self.condition.wait()
+            return (self.nav_seq, json.loads(json.dumps(self.navdata)))
+
+    def get_navdata(self):
+        with self.condition:
+            return json.loads(json.dumps(self.navdata))
+
+    def log_cmd(self, line, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.log_lock:
+            self.num_cmds += 1
+            if self.cmd_log is not None:
+                self.cmd_log.write('%.6f %s\n' % (timestamp, line))
+                self.cmd_log.flush()
+
+    def get_delay(self):
+        return get_delay(self.latency, self.jitter)
+
+
+class DelayedWriter(threading.Thread):
+    """ Writes each reply to a client once the injected latency has passed
+        since it was written, so the latency is added to every reply rather
+        than adding up while the handler waits. The replies keep their order,
+        as they would on a TCP connection.
+    """
+    def __init__(self, wfile, simulator):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.wfile = wfile
+        self.simulator = simulator
+        self.queue = Queue.Queue()
+        self.last = 0.0
+        self.start()
+
+    def write(self, data):
+        """ Schedules the data to be written after the latency and returns the
+            time it is written at.
+        """
+        send_at = max(time.time() + self.simulator.get_delay(), self.last)
+        self.last = send_at
+        self.queue.put((send_at, data))
+        return send_at
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            (send_at, data) = item
+            delay = send_at - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.wfile.write(data)
+                self.wfile.flush()
+            except socket.error:
+                break
+
+    def close(self):
+        """ Writes the scheduled replies and stops.
+        """
+        self.queue.put(None)
+        self.join()
+
+
+class CommandHandler(SocketServer.StreamRequestHandler):
+    """ Logs each command line and acknowledges its sequence number after the
+        injected latency, like the command server of parrot_server.js.
+    """
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sim = self.server.simulator
+        writer = DelayedWriter(self.wfile, sim)
+        try:
+            for line in iter(self.rfile.readline, ''):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    query = json.loads(line)
+                except ValueError:
+                    print('Error: received query is not valid json.')
+                    continue
+
+                # The command reaches the drone after the latency, and is
+                # acknowledged then.
+                if 'SEQ' in query:
+                    received = writer.write(json.dumps({'ACK': query['SEQ']}) + '\n')
+                else:
+                    received = time.time() + sim.get_delay()
+                sim.log_cmd(line, received)
+        finally:
+            writer.close()
+
+
+class NavdataHandler(SocketServer.StreamRequestHandler):
+    """ Answers navigation data queries like the navigation data server of
+        parrot_server.js, pushing every update to a subscribed client.
+    """
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sim = self.server.simulator
+        self.fields = None
+        self.writer = DelayedWriter(self.wfile, self.sim)
+        try:
+            for line in iter(self.rfile.readline, ''):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    query = json.loads(line)
+                except ValueError:
+                    print('Error: received query is not valid json.')
+                    continue
+                if query.get('N') and isinstance(query.get('FIELDS'), list):
+                    self.fields = query['FIELDS']
+                if query.get('N') and query.get('SUB'):
+                    # The subscribed client only gets pushed data from now on.
+                    self.push()
+                    return
+                elif query.get('N'):
+                    self.writer.write(self.encode(self.sim.get_navdata()))
+        finally:
+            self.writer.close()
+
+    def push(self):
+        """ Pushes every update of the navigation data as it is made, each
+            delayed by the latency, until the client goes away.
+        """
+        seq = 0
+        while self.writer.is_alive():
+            (seq, navdata) = self.sim.wait_navdata(seq)
+            self.writer.write(self.encode(navdata))
+
+    def encode(self, navdata):
+        if self.fields is not None:
+            return pack_fields(navdata, self.fields)
+        return json.dumps(navdata) + '\n'
+
+
+class VideoHandler(SocketServer.StreamRequestHandler):
+    """ Serves the frames as an MJPEG stream over HTTP at the video rate,
+        with each frame delayed by the injected latency.
+    """
+    boundary = 'frame'
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sim = self.server.simulator
+
+        # Skip the request, any request gets the stream.
+        for line in iter(self.rfile.readline, ''):
+            if line in ('\r\n', '\n'):
+                break
+        self.wfile.write('HTTP/1.0 200 OK\r\n'
+                         'Content-Type: multipart/x-mixed-replace; boundary=%s\r\n\r\n' % self.boundary)
+
+        # Send each frame at its scheduled time, relative to the start so that
+        # the delays don't add up.
+        period = 1.0/sim.video_rate
+        start = time.time()
+        i = 0
+        while True:
+            jpg = sim.frames[i % len(sim.frames)]
+            delay = start + i*period + get_delay(sim.latency, sim.jitter) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.wfile.write('--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % (self.boundary, len(jpg)))
+            self.wfile.write(jpg)
+            self.wfile.write('\r\n')
+            i += 1
+
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, port, handler, simulator):
+        SocketServer.TCPServer.__init__(self, ('', port), handler)
+        self.simulator = simulator
+
+    def handle_error(self, request, client_address):
+        # Clients going away mid stream are expected.
+        (exc_type, exc_value, _) = sys.exc_info()
+        if not issubclass(exc_type, socket.error):
+            SocketServer.TCPServer.handle_error(self, request, client_address)
+
+
+def read_navdata(filename):
+    """ Reads the navigation data from a file holding it as a Python literal.
+    """
+    with open(filename) as f:
+        return ast.literal_eval(f.read())
+
+
+def read_frames(filename, quality=90):
+    """ Reads the frames of a video and encodes each as a JPEG once, so
+        serving them costs nothing. Returns the frames and the video's rate.
+    """
+    cap = cv2.VideoCapture(filename)
+    if not cap.isOpened():
+        raise IOError('unable to open video %s' % filename)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frames = []
+    try:
+        while True:
+            (ret, image) = cap.read()
+            if not ret:
+                break
+            (ret, jpg) = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            frames.append(jpg.tostring())
+    finally:
+        cap.release()
+    if not frames:
+        raise IOError('video %s has no frames' % filename)
+    return (frames, fps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulates the drone and its Node js servers.')
+    parser.add_argument('--navdata', type=str, default=os.path.join(SAMPLES, 'sample_navdata.txt'), help='The navigation data to replay, as a Python literal.')
+    parser.add_argument('--video', type=str, default=os.path.join(SAMPLES, 'test_cat.mp4'), help='The video to stream, over and over.')
+    parser.add_argument('--nav-rate', type=float, default=15.0, help='The navigation data updates per second.')
+    parser.add_argument('--video-rate', type=float, default=None, help='The frames per second of the stream (default the rate of the video).')
+    parser.add_argument('--latency', type=float, default=0.0, help='The latency added to every reply and frame, in seconds.')
+    parser.add_argument('--jitter', type=float, default=0.0, help='The most the latency varies by, in seconds.')
+    parser.add_argument('--cmd-log', type=str, default=None, help='The file to log the received commands to.')
+    parser.add_argument('--cmd-port', type=int, default=9000)
+    parser.add_argument('--recv-port', type=int, default=9001)
+    parser.add_argument('--video-port', type=int, default=5555)
+    args = parser.parse_args()
+
+    print('Simulator of the Parrot AR drone.')
+    navdata = read_navdata(args.navdata)
+    (frames, fps) = read_frames(args.video)
+    video_rate = args.video_rate or fps or 15.0
+    cmd_log = open(args.cmd_log, 'a') if args.cmd_log else None
+    sim = Simulator(navdata, frames, args.nav_rate, video_rate, args.latency, args.jitter, cmd_log)
+
+    servers = [Server(args.cmd_port, CommandHandler, sim),
+               Server(args.recv_port, NavdataHandler, sim),
+               Server(args.video_port, VideoHandler, sim)]
+    for server in servers:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+    print(':: Listening for commands on port %d.' % args.cmd_port)
+    print(':: Listening for query to send navigation data on port %d.' % args.recv_port)
+    print(':: Streaming %d frames at %.1f per second on port %d.' % (len(frames), video_rate, args.video_port))
+
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        print(':: Received %d commands.' % sim.num_cmds)
+    finally:
+        if cmd_log is not None:
+            cmd_log.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+""" Tracking package.
+
+    The trackers import the frame module of the flying tool from src, like
+    fly.py does, so run their tests from src, e.g.
+    python2 -m tracking.cam_shift.
+"""
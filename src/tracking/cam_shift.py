@@ -7,6 +7,8 @@ import numpy as np
 import cv2
 import bounding_box as bb
 
+from frame import as_frame
+
 
 class CamShift(object):
     """ Cam shift algorithm.
@@ -26,8 +28,7 @@ class CamShift(object):
         self.track_window = (c, r, w, h)
 
         # Set up the ROI for tracking.
-        roi = init_frame[r:r+h, c:c+w]
-        hsv_roi =  cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
+        hsv_roi = as_frame(init_frame).get_hsv()[r:r+h, c:c+w]
         mask = cv2.inRange(hsv_roi, np.array((0., 60., 32.)), np.array((180., 255., 255.)))
         self.roi_hist = cv2.calcHist([hsv_roi], [0], mask, [180], [0, 180])
         cv2.normalize(self.roi_hist, self.roi_hist, 0, 255, cv2.NORM_MINMAX)
@@ -36,7 +37,12 @@ class CamShift(object):
         self.term_crit = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 1)
 
     def extract(self, frame):
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        """ Tracks the object in the frame (an image or a Frame) and draws
+            it on the image.
+        """
+        frame = as_frame(frame)
+        hsv = frame.get_hsv()
+        frame = frame.image
         dst = cv2.calcBackProject([hsv], [0], self.roi_hist, [0, 180], 1)
 
         # Apply meanshift to get the new location.